@@ -6,9 +6,48 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 
 
-def __init_confusion_matrix_rows__(out_labels: np.ndarray) -> dict[Any, np.ndarray]:
-    out_labels_size = out_labels.shape[0]
-    return dict(map(lambda x: (x, np.zeros(out_labels_size)), out_labels))
+def encode_labels(possible_out_labels: np.ndarray, labels: Any) -> np.ndarray:
+    # Position of every label in possible_out_labels
+    codes = pd.Index(possible_out_labels).get_indexer(np.asarray(labels, dtype=object))
+    if (codes < 0).any():
+        raise KeyError(np.asarray(labels, dtype=object)[int(np.flatnonzero(codes < 0)[0])])
+    return codes
+
+
+def confusion_matrix_counts(possible_out_labels: np.ndarray, predicted_labels: Any, expected_labels: Any
+                            ) -> np.ndarray:
+    # Rows are the expected labels and columns the predicted ones, in the order of possible_out_labels.
+    # Each (expected, predicted) pair is the single code expected * n + predicted, counted with one bincount.
+    out_labels_size = len(possible_out_labels)
+    pair_codes = encode_labels(possible_out_labels, expected_labels) * out_labels_size + \
+        encode_labels(possible_out_labels, predicted_labels)
+    return np.bincount(pair_codes, minlength=out_labels_size * out_labels_size) \
+        .reshape(out_labels_size, out_labels_size).astype(float)
+
+
+def per_label_counts(counts: np.ndarray) -> dict[str, np.ndarray]:
+    # TP/FP/FN/TN of every label at once, taking each label as the positive one in turn
+    true_positives = np.diag(counts)
+    false_positives = counts.sum(axis=0) - true_positives
+    false_negatives = counts.sum(axis=1) - true_positives
+    true_negatives = counts.sum() - true_positives - false_positives - false_negatives
+    return {
+        "TP": true_positives,
+        "FP": false_positives,
+        "FN": false_negatives,
+        "TN": true_negatives
+    }
+
+
+def __confusion_matrix_frame__(counts: np.ndarray, possible_out_labels: np.ndarray) -> pd.DataFrame:
+    return pd.DataFrame(counts, columns=possible_out_labels, index=possible_out_labels)
+
+
+def __confusion_matrix_counts_from_frame__(confusion_matrix: pd.DataFrame) -> np.ndarray:
+    # Rows in the order of the columns, so the diagonal holds the matches
+    if not confusion_matrix.index.equals(confusion_matrix.columns):
+        confusion_matrix = confusion_matrix.loc[confusion_matrix.columns]
+    return confusion_matrix.to_numpy(dtype=float)
 
 
 def get_confusion_matrix_row(conf_mat: pd.DataFrame, real: Any) -> pd.DataFrame:
@@ -21,12 +60,9 @@ def get_confusion_matrix_value(conf_mat: pd.DataFrame, real: Any, predicted: Any
 
 def calculate_confusion_matrix(possible_out_labels: np.ndarray, predicted: dict[Any, Any],
                                expected: dict[Any, Any]) -> pd.DataFrame:
-    data = __init_confusion_matrix_rows__(possible_out_labels)
-    conf_mat_df = pd.DataFrame(columns=possible_out_labels, index=possible_out_labels, data=data)
-    for expected_idx, expected_label in expected.items():
-        predicted_label = predicted[expected_idx]
-        conf_mat_df[predicted_label][expected_label] += 1
-    return conf_mat_df
+    predicted_labels = [predicted[expected_idx] for expected_idx in expected.keys()]
+    counts = confusion_matrix_counts(possible_out_labels, predicted_labels, list(expected.values()))
+    return __confusion_matrix_frame__(counts, possible_out_labels)
 
 
 def calculate_relative_confusion_matrix(possible_out_labels: np.ndarray, predicted: dict[Any, Any],
@@ -42,20 +78,26 @@ def calculate_relative_confusion_matrix_from_confusion_matrix(confusion_matrix:
     return rel_conf_mat_df
 
 
+def __positive_counts__(confusion_matrix: pd.DataFrame, positive_label: Any) -> dict[str, Any]:
+    counts = __confusion_matrix_counts_from_frame__(confusion_matrix)
+    label_pos = confusion_matrix.columns.get_loc(positive_label)
+    return {key: vals[label_pos] for key, vals in per_label_counts(counts).items()}
+
+
 def calculate_true_positives_from_confusion_matrix(confusion_matrix: pd.DataFrame, positive_label: Any) -> float:
-    return confusion_matrix.loc[positive_label][positive_label]
+    return __positive_counts__(confusion_matrix, positive_label)["TP"]
 
 
 def calculate_false_positives_from_confusion_matrix(confusion_matrix: pd.DataFrame, positive_label: Any) -> float:
-    return confusion_matrix.drop([positive_label], axis="index")[[positive_label]].values.sum()
+    return __positive_counts__(confusion_matrix, positive_label)["FP"]
 
 
 def calculate_false_negatives_from_confusion_matrix(confusion_matrix: pd.DataFrame, positive_label: Any) -> float:
-    return confusion_matrix.drop([positive_label], axis="columns").loc[positive_label].values.sum()
+    return __positive_counts__(confusion_matrix, positive_label)["FN"]
 
 
 def calculate_true_negatives_from_confusion_matrix(confusion_matrix: pd.DataFrame, positive_label: Any) -> float:
-    return confusion_matrix.drop([positive_label], axis="index").drop([positive_label], axis="columns").values.sum()
+    return __positive_counts__(confusion_matrix, positive_label)["TN"]
 
 
 def calculate_true_positive_rate_from_confusion_matrix(confusion_matrix: pd.DataFrame, positive_label: Any) -> float:
@@ -70,9 +112,9 @@ def calculate_false_positive_rate_from_confusion_matrix(confusion_matrix: pd.Dat
     return FP / (FP + TN)
 
 
-def __init_per_label_confusion_matrix__() -> pd.DataFrame:
-    return pd.DataFrame(data={"P": np.zeros(2),
-                              "N": np.zeros(2)
+def __per_label_confusion_matrix__(TP: float, FP: float, FN: float, TN: float) -> pd.DataFrame:
+    return pd.DataFrame(data={"P": np.array([TP, FP], dtype=float),
+                              "N": np.array([FN, TN], dtype=float)
                               }, index=["P", "N"])
 
 
@@ -83,18 +125,11 @@ def calculate_per_label_confusion_matrix(possible_out_labels: np.ndarray, predic
 
 
 def calculate_per_label_confusion_matrix_from_confusion_matrix(confusion_matrix: pd.DataFrame) -> pd.DataFrame:
+    label_counts = per_label_counts(__confusion_matrix_counts_from_frame__(confusion_matrix))
     per_label_conf_mats = dict()
-    for possible_out_label in confusion_matrix.columns:
-        curr_label_conf_mat = __init_per_label_confusion_matrix__()
-        curr_label_conf_mat.loc["P"]["P"] = calculate_true_positives_from_confusion_matrix(confusion_matrix,
-                                                                                           possible_out_label)
-        curr_label_conf_mat.loc["N"]["P"] = calculate_false_positives_from_confusion_matrix(confusion_matrix,
-                                                                                            possible_out_label)
-        curr_label_conf_mat.loc["P"]["N"] = calculate_false_negatives_from_confusion_matrix(confusion_matrix,
-                                                                                            possible_out_label)
-        curr_label_conf_mat.loc["N"]["N"] = calculate_true_negatives_from_confusion_matrix(confusion_matrix,
-                                                                                           possible_out_label)
-        per_label_conf_mats[possible_out_label] = curr_label_conf_mat
+    for label_pos, possible_out_label in enumerate(confusion_matrix.columns):
+        per_label_conf_mats[possible_out_label] = __per_label_confusion_matrix__(
+            *(label_counts[key][label_pos] for key in ("TP", "FP", "FN", "TN")))
     return per_label_conf_mats
 
 
@@ -127,49 +162,82 @@ def metrics(per_label_conf_mats):
     metrics_per_label = {}
 
     for label, label_conf_mat in per_label_conf_mats.items():
-        TP = calculate_true_positives_from_confusion_matrix(label_conf_mat, "P")
-        FP = calculate_false_positives_from_confusion_matrix(label_conf_mat, "P")
-        FN = calculate_false_negatives_from_confusion_matrix(label_conf_mat, "P")
-        TN = calculate_true_negatives_from_confusion_matrix(label_conf_mat, "P")
-
-        precision = TP / (TP + FP) if TP != 0 else 0
-        recall = TP / (TP + FN) if TP != 0 else 0
-        f1_score = 2 * (precision * recall) / (precision + recall) if (precision * recall) != 0 else 0
-        accuracy = (TP + TN) / (TP + TN + FP + FN)
-
-        metrics_per_label[label] = {
-            "TP": TP,
-            "FP": FP,
-            "FN": FN,
-            "TN": TN,
-            "Precision": precision,
-            "Recall": recall,
-            "F1 Score": f1_score,
-            "Accuracy": accuracy
-        }
+        metrics_per_label[label] = __metrics_from_counts__(**__positive_counts__(label_conf_mat, "P"))
     return metrics_per_label
 
 
+def __metrics_from_counts__(TP: float, FP: float, FN: float, TN: float) -> dict[str, Any]:
+    precision = TP / (TP + FP) if TP != 0 else 0
+    recall = TP / (TP + FN) if TP != 0 else 0
+    f1_score = 2 * (precision * recall) / (precision + recall) if (precision * recall) != 0 else 0
+    accuracy = (TP + TN) / (TP + TN + FP + FN)
+
+    return {
+        "TP": TP,
+        "FP": FP,
+        "FN": FN,
+        "TN": TN,
+        "Precision": precision,
+        "Recall": recall,
+        "F1 Score": f1_score,
+        "Accuracy": accuracy
+    }
+
+
+def positive_scores(prediction_probabilities: dict[Any, dict[str, Any]], expected: dict[Any, Any],
+                    positive_label: Any = "P", negative_label: Any = "N") -> np.ndarray:
+    # Probability of the positive label normalised over both labels, for the samples of expected in order.
+    # Samples with both probabilities at 0 get NaN, which no threshold predicts as positive.
+    sample_probas = [prediction_probabilities[expected_idx] for expected_idx in expected.keys()]
+    positive_probas = np.array([probas[positive_label] for probas in sample_probas], dtype=float)
+    negative_probas = np.array([probas[negative_label] for probas in sample_probas], dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return positive_probas / (positive_probas + negative_probas)
+
+
+def roc_counts(scores: np.ndarray, is_positive: np.ndarray, thresholds: Any) -> dict[str, np.ndarray]:
+    # TP/FP/FN/TN at every threshold, a sample being predicted positive when its score is >= the threshold.
+    # Scores are sorted once, so the positives at or above a threshold are the positives after the
+    # threshold's searchsorted position, read off their cumulative sum: O((n + thresholds) log n).
+    is_observed = ~np.isnan(scores)
+    order = np.argsort(scores[is_observed], kind="stable")
+    sorted_scores = scores[is_observed][order]
+    positives_below = np.concatenate([[0], np.cumsum(is_positive[is_observed][order])])
+
+    below = np.searchsorted(sorted_scores, np.asarray(thresholds, dtype=float), side="left")
+    true_positives = positives_below[-1] - positives_below[below]
+    false_positives = sorted_scores.size - below - true_positives
+    positives_count = np.count_nonzero(is_positive)
+    return {
+        "TP": true_positives.astype(float),
+        "FP": false_positives.astype(float),
+        "FN": (positives_count - true_positives).astype(float),
+        "TN": (is_positive.size - positives_count - false_positives).astype(float)
+    }
+
+
+def __roc_counts_from_probabilities__(prediction_probabilities: dict[Any, dict[str, Any]], expected: dict[Any, Any],
+                                      thresholds: Any, positive_label: Any, negative_label: Any
+                                      ) -> dict[str, np.ndarray]:
+    # Expected labels other than the two raise KeyError, as in calculate_confusion_matrix
+    is_positive = encode_labels(np.array([positive_label, negative_label]), list(expected.values())) == 0
+    scores = positive_scores(prediction_probabilities, expected, positive_label, negative_label)
+    return roc_counts(scores, is_positive, thresholds)
+
+
 def calculate_roc_confusion_matrices(prediction_probabilities: dict[Any, dict[str, Any]], expected: dict[Any, Any],
                                      thresholds: np.ndarray, positive_label: Any = "P", negative_label: Any = "N") -> \
         list[dict[str, Any]]:
+    counts = __roc_counts_from_probabilities__(prediction_probabilities, expected, thresholds, positive_label,
+                                               negative_label)
+    possible_out_labels = np.array([positive_label, negative_label])
     conf_mats = []
-    for threshold in thresholds:
-        positive_prediction_probas = dict()
-        for prediction_proba_idx in prediction_probabilities.keys():
-            proba_positive_scaled = prediction_probabilities[prediction_proba_idx][positive_label]
-            proba_negative_scaled = prediction_probabilities[prediction_proba_idx][negative_label]
-            true_positive_proba = proba_positive_scaled / (proba_positive_scaled + proba_negative_scaled)
-            positive_prediction_probas[prediction_proba_idx] = true_positive_proba
-        predicted = dict()
-        for pos_predict_proba_idx in positive_prediction_probas.keys():
-            predicted[pos_predict_proba_idx] = positive_label if positive_prediction_probas[
-                                                                     pos_predict_proba_idx] >= threshold \
-                else negative_label
+    for threshold_pos, threshold in enumerate(thresholds):
+        conf_mat_counts = np.array([[counts["TP"][threshold_pos], counts["FN"][threshold_pos]],
+                                    [counts["FP"][threshold_pos], counts["TN"][threshold_pos]]])
         conf_mats.append({
             "threshold": threshold,
-            "confusion_matrix": calculate_confusion_matrix(np.array([positive_label, negative_label]), predicted,
-                                                           expected)
+            "confusion_matrix": __confusion_matrix_frame__(conf_mat_counts, possible_out_labels)
         })
     return conf_mats
 
@@ -177,21 +245,32 @@ def calculate_roc_confusion_matrices(prediction_probabilities: dict[Any, dict[st
 def calculate_roc_positive_rates(roc_confusion_matrices: list[dict[str, Any]]) -> list[dict[str, Any]]:
     positive_rates = []
     for i in range(len(roc_confusion_matrices)):
-        conf_mat = roc_confusion_matrices[i]["confusion_matrix"]
-        TPR = calculate_true_positive_rate_from_confusion_matrix(conf_mat, "P")
-        FPR = calculate_false_positive_rate_from_confusion_matrix(conf_mat, "P")
-        conf_mat_metrics = metrics({
-            "metrics": conf_mat
-        })
-        positive_rates.append({
-            "threshold": roc_confusion_matrices[i]["threshold"],
-            "TPR": TPR,
-            "FPR": FPR,
-            "metrics": conf_mat_metrics["metrics"]
-        })
+        conf_mat_counts = __positive_counts__(roc_confusion_matrices[i]["confusion_matrix"], "P")
+        positive_rates.append(__positive_rate__(roc_confusion_matrices[i]["threshold"], **conf_mat_counts))
     return positive_rates
 
 
+def calculate_roc_positive_rates_from_probabilities(prediction_probabilities: dict[Any, dict[str, Any]],
+                                                    expected: dict[Any, Any], thresholds: np.ndarray,
+                                                    positive_label: Any = "P", negative_label: Any = "N"
+                                                    ) -> list[dict[str, Any]]:
+    # Same as calculate_roc_positive_rates over calculate_roc_confusion_matrices, without building a
+    # confusion matrix frame per threshold, for dense threshold grids
+    counts = __roc_counts_from_probabilities__(prediction_probabilities, expected, thresholds, positive_label,
+                                               negative_label)
+    return [__positive_rate__(threshold, *(counts[key][threshold_pos] for key in ("TP", "FP", "FN", "TN")))
+            for threshold_pos, threshold in enumerate(thresholds)]
+
+
+def __positive_rate__(threshold: Any, TP: float, FP: float, FN: float, TN: float) -> dict[str, Any]:
+    return {
+        "threshold": threshold,
+        "TPR": TP / (TP + FN),
+        "FPR": FP / (FP + TN),
+        "metrics": __metrics_from_counts__(TP, FP, FN, TN)
+    }
+
+
 # TODO: Revisar si esta permitido usar AUC de Sklearn
 def calculate_auc_from_positive_rates(positive_rates: list[dict[str, Any]]) -> float:
     FPRs, TPRs = np.array(list(map(lambda pr: pr["FPR"], positive_rates))), np.array(
@@ -1,54 +1,282 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-from sklearn.experimental import enable_iterative_imputer
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.impute import KNNImputer, IterativeImputer
-from sklearn.linear_model import LinearRegression, BayesianRidge
-from typing import Any
+from typing import Any, Iterable, Iterator
 
+from utils.imputer_cache import imputer_cache_key, load_cached, store_cached
+from utils.imputer_registry import get_imputer_info, make_imputer
+from utils.instrumentation import instrumented, stage
+from utils.knn_sweep import knn_impute_sweep
+from utils.mice_sweep import mice_round_snapshots, truncate_iterative_imputer
+from utils.scaling import fit_scaler, scale_values, unscale_values
+from utils.shared_frames import attach_frame, release_frames, share_frame
 
-def imputed_vals(cols : list[str], df : pd.DataFrame) -> tuple[dict, dict]:
-    real_var_map_dict = dict()
-    imputed_var_map_dict = dict()
-    for col in cols:
-        imputed_var_map_dict[col] = []
-        real_var_map_dict[col] = []
 
-    for _, sample in df.iterrows():
-        imputed_col = sample["imputed"]
+def __imputed_pairs__(cols: list[str], df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, np.ndarray, list]:
+    # Gathers the (real, imputed) value of each row's imputed column in one pass over the frame,
+    # returning them with the position in cols of every row's imputed column.
+    cols = list(cols)
+    imputed_codes, imputed_cols = pd.factorize(df["imputed"])
+    unknown_cols = [col for col in imputed_cols if col not in cols]
+    if unknown_cols:
+        raise KeyError(unknown_cols[0])
+
+    row_pos = np.arange(df.shape[0])
+    real_mat = df[[col + " (real)" for col in imputed_cols]].to_numpy(dtype=float)
+    imputed_mat = df[[col + " (imputed)" for col in imputed_cols]].to_numpy(dtype=float)
+    real_vals = real_mat[row_pos, imputed_codes]
+    imputed_vals = imputed_mat[row_pos, imputed_codes]
+
+    col_pos = np.array([cols.index(col) for col in imputed_cols], dtype=np.intp)[imputed_codes]
+    return real_vals, imputed_vals, col_pos, cols
 
-        real_val = sample[imputed_col + " (real)"]
-        imputed_val = sample[imputed_col + " (imputed)"]
 
-        imputed_var_map_dict[imputed_col].append(imputed_val)
-        real_var_map_dict[imputed_col].append(real_val)
+def imputed_vals(cols : list[str], df : pd.DataFrame) -> tuple[dict, dict]:
+    real_vals, imputed_vals, col_pos, cols = __imputed_pairs__(cols, df)
+    order = np.argsort(col_pos, kind="stable")
+    bounds = np.searchsorted(col_pos[order], np.arange(len(cols) + 1))
+
+    real_var_map_dict = dict()
+    imputed_var_map_dict = dict()
+    for i, col in enumerate(cols):
+        col_rows = order[bounds[i]:bounds[i + 1]]
+        imputed_var_map_dict[col] = imputed_vals[col_rows].tolist()
+        real_var_map_dict[col] = real_vals[col_rows].tolist()
 
     return imputed_var_map_dict, real_var_map_dict
 
-def imputed_sqr_err(cols: list[str], df: pd.DataFrame) -> dict:
-    imputed_map_dict = dict()
-    for col in cols:
-        imputed_map_dict[col] = []
 
-    for _, sample in df.iterrows():
-        imputed_col = sample["imputed"]
+def __err_stats__(err: np.ndarray, col_pos: np.ndarray, cols: list) -> pd.DataFrame:
+    # bincount adds the weights in row order, so sums match a sequential sum per column
+    counts = np.bincount(col_pos, minlength=len(cols))
+    sqr_err_sums = np.bincount(col_pos, weights=err ** 2, minlength=len(cols))
+    abs_err_sums = np.bincount(col_pos, weights=np.abs(err), minlength=len(cols))
 
-        real_val = sample[imputed_col + " (real)"]
-        imputed_val = sample[imputed_col + " (imputed)"]
+    safe_counts = np.where(counts != 0, counts, 1)
+    mse = np.where(counts != 0, sqr_err_sums / safe_counts, 0)
+    mae = np.where(counts != 0, abs_err_sums / safe_counts, 0)
+    return pd.DataFrame({
+        "col": cols,
+        "count": counts,
+        "MSE": mse,
+        "RMSE": np.sqrt(mse),
+        "MAE": mae
+    })
 
-        imputed_map_dict[imputed_col].append((real_val - imputed_val) ** 2)
 
-    imputed_map = dict()
+def imputed_err_stats(cols: list[str], df: pd.DataFrame) -> pd.DataFrame:
+    real_vals, imputed_vals, col_pos, cols = __imputed_pairs__(cols, df)
+    return __err_stats__(real_vals - imputed_vals, col_pos, cols)
 
-    for key in imputed_map_dict.keys():
-        sqr_err_list = imputed_map_dict[key]
-        sqr_err_len = len(sqr_err_list)
-        sqr_err_sum = sum(sqr_err_list)
-        mean_sqr_err = sqr_err_sum / sqr_err_len if sqr_err_len != 0 else 0
-        imputed_map[key] = mean_sqr_err
 
-    return imputed_map
+@instrumented("imputed_sqr_err")
+def imputed_sqr_err(cols: list[str], df: pd.DataFrame) -> dict:
+    err_stats = imputed_err_stats(cols, df)
+    return dict(zip(err_stats["col"], err_stats["MSE"].tolist()))
+
+
+def __row_positions__(index: pd.Index, idxs: Iterable) -> np.ndarray:
+    row_pos = index.get_indexer(idxs)
+    if (row_pos < 0).any():
+        raise KeyError(list(idxs)[int(np.flatnonzero(row_pos < 0)[0])])
+    return row_pos
+
+
+def prepare_imputation(labeled_df: pd.DataFrame,
+                       random_missing_df: pd.DataFrame,
+                       missing_vals_idxs: list,
+                       missing_col_per_pos: list,
+                       scale: bool = False) -> dict:
+    # Gathers the training rows, the rows to impute and the real value of every imputed cell into
+    # float matrices once. With scale, the imputed columns are min/max scaled in place with a scaler
+    # fitted on the observed training cells only, and the real values are moved to the same space.
+    values = random_missing_df.to_numpy(dtype=float)
+    train_idxs = random_missing_df.index.difference(missing_vals_idxs)
+    train_vals = values[random_missing_df.index.get_indexer(train_idxs)]
+    missing_vals = values[__row_positions__(random_missing_df.index, missing_vals_idxs)]
+
+    missing_col_pos = __row_positions__(labeled_df.columns, missing_col_per_pos)
+    labeled_rows = labeled_df.iloc[__row_positions__(labeled_df.index, missing_vals_idxs)]
+    real_vals = labeled_rows.to_numpy(dtype=float)[np.arange(len(missing_col_pos)), missing_col_pos]
+
+    scaler = None
+    err_scale = None
+    if scale:
+        scaler, real_vals, err_scale = __scale_in_place__(train_vals, missing_vals, real_vals, missing_col_pos)
+
+    return {
+        "train_df": pd.DataFrame(train_vals, index=train_idxs, columns=random_missing_df.columns, copy=False),
+        "missing_df": pd.DataFrame(missing_vals, index=labeled_rows.index, columns=random_missing_df.columns,
+                                   copy=False),
+        "labeled_rows": labeled_rows,
+        "real_vals": real_vals,
+        "missing_col_pos": missing_col_pos,
+        "cols": list(labeled_df.columns),
+        "scaler": scaler,
+        "err_scale": err_scale
+    }
 
 
+def __scale_in_place__(train_vals: np.ndarray, missing_vals: np.ndarray, real_vals: np.ndarray,
+                       missing_col_pos: np.ndarray, scaler: dict = None) -> tuple[dict, np.ndarray, np.ndarray]:
+    if scaler is None:
+        scaler = fit_scaler(train_vals, np.unique(missing_col_pos))
+    scale_values(train_vals, scaler)
+    scale_values(missing_vals, scaler)
+    real_vals = (real_vals - scaler["min"][missing_col_pos]) / scaler["range"][missing_col_pos]
+    return scaler, real_vals, scaler["range"][missing_col_pos]
+
+
+def scale_imputation(imputation_data: dict, scaler: dict = None) -> dict:
+    # Scaled copy of unscaled imputation data, as prepare_imputation would have made it, with scaler
+    # instead of one fitted on the training cells if given
+    train_vals = imputation_data["train_df"].to_numpy(dtype=float, copy=True)
+    missing_vals = imputation_data["missing_df"].to_numpy(dtype=float, copy=True)
+    scaler, real_vals, err_scale = __scale_in_place__(train_vals, missing_vals, imputation_data["real_vals"],
+                                                      imputation_data["missing_col_pos"], scaler)
+    return dict(imputation_data,
+                train_df=pd.DataFrame(train_vals, index=imputation_data["train_df"].index,
+                                      columns=imputation_data["train_df"].columns, copy=False),
+                missing_df=pd.DataFrame(missing_vals, index=imputation_data["missing_df"].index,
+                                        columns=imputation_data["missing_df"].columns, copy=False),
+                real_vals=real_vals,
+                scaler=scaler,
+                err_scale=err_scale)
+
+
+def evaluate_imputation_stats(imputed_mat: np.ndarray, imputation_data: dict) -> pd.DataFrame:
+    missing_col_pos = imputation_data["missing_col_pos"]
+    err = imputation_data["real_vals"] - imputed_mat[np.arange(imputed_mat.shape[0]), missing_col_pos]
+    if imputation_data["err_scale"] is not None:
+        # Errors are taken in scaled space, the column range brings them back to the data's units
+        err *= imputation_data["err_scale"]
+    return __err_stats__(err, missing_col_pos, imputation_data["cols"])
+
+
+def evaluate_imputation(imputed_mat: np.ndarray, imputation_data: dict) -> dict:
+    err_stats = evaluate_imputation_stats(imputed_mat, imputation_data)
+    return dict(zip(err_stats["col"], err_stats["MSE"].tolist()))
+
+
+def fit_sweep_point(imputer: Any, imputation_data: dict) -> tuple[Any, dict]:
+    with stage("fit", rows=imputation_data["train_df"].shape[0]):
+        imputer = imputer.fit(imputation_data["train_df"])
+    with stage("transform", rows=imputation_data["missing_df"].shape[0]):
+        imputed_mat = imputer.transform(imputation_data["missing_df"])
+    with stage("evaluate", rows=imputed_mat.shape[0]):
+        return imputer, evaluate_imputation(imputed_mat, imputation_data)
+
+
+def can_sweep_knn_once(imputer_type: str, var_param: str, param_type: str, config: dict,
+                       train_df: pd.DataFrame) -> bool:
+    if imputer_type not in knn_sweep_weights or var_param != "n_neighbors" or param_type != "imputer":
+        return False
+    # Any other KNNImputer option (metric, add_indicator, missing_values, ...) takes the regular path
+    if not set(config.keys()).issubset({"copy"}):
+        return False
+    return not train_df.isna().all(axis=0).any()
+
+
+def fit_knn_sweep(imputers: list,
+                  n_neighbors_range: list,
+                  weights: str,
+                  imputation_data: dict) -> list[tuple[Any, dict]]:
+    train_df = imputation_data["train_df"]
+    with stage("knn_impute_sweep", rows=imputation_data["missing_df"].shape[0]):
+        imputed_mats = knn_impute_sweep(train_df.to_numpy(dtype=float),
+                                        imputation_data["missing_df"].to_numpy(dtype=float), n_neighbors_range,
+                                        weights)
+
+    sweep_results = []
+    for imputer, n_neighbors in zip(imputers, n_neighbors_range):
+        # Fitting a KNNImputer only stores the training data, so the imputer map stays the same
+        imputer = imputer.fit(train_df)
+        with stage("evaluate", rows=imputed_mats[n_neighbors].shape[0]):
+            sweep_results.append((imputer, evaluate_imputation(imputed_mats[n_neighbors], imputation_data)))
+    return sweep_results
+
+
+# Per worker process state for parallel sweeps, set once by __init_sweep_worker__
+__sweep_worker_state__ = dict()
+
+
+def __init_sweep_worker__(train_spec: dict, missing_spec: dict, imputation_data: dict) -> None:
+    train_shm, train_df = attach_frame(train_spec)
+    missing_shm, missing_df = attach_frame(missing_spec)
+    __sweep_worker_state__.update({
+        "shms": [train_shm, missing_shm],
+        "imputation_data": dict(imputation_data, train_df=train_df, missing_df=missing_df)
+    })
+
+
+def __fit_sweep_point_in_worker__(imputer: Any) -> tuple[Any, dict]:
+    return fit_sweep_point(imputer, __sweep_worker_state__["imputation_data"])
+
+
+def __random_state_copies__(configs: list[dict]) -> dict:
+    # Copies of the RandomStates of configs by id, for the sweep seeds to be drawn from
+    random_state_copies = dict()
+    for config in configs:
+        random_state = config.get("random_state")
+        if isinstance(random_state, np.random.RandomState) and id(random_state) not in random_state_copies:
+            random_state_copy = np.random.RandomState()
+            random_state_copy.set_state(random_state.get_state())
+            random_state_copies[id(random_state)] = random_state_copy
+    return random_state_copies
+
+
+def __seed_from_random_state__(config: dict, random_state_copies: dict) -> dict:
+    # Sweep points fitted in other processes can't share a RandomState, so each one gets a seed
+    # drawn in sweep order from it, which keeps the whole sweep a function of the initial seed. The
+    # seeds come from a copy, which leaves the caller's RandomState where it was.
+    random_state = config.get("random_state")
+    if isinstance(random_state, np.random.RandomState):
+        config["random_state"] = random_state_copies[id(random_state)].randint(np.iinfo(np.int32).max)
+    return config
+
+
+def can_warm_start_mice(imputer_type: str, var_param: str, param_type: str, config: dict,
+                        train_df: pd.DataFrame) -> bool:
+    if not get_imputer_info(imputer_type)["supports_warm_start"] or var_param != "max_iter" or \
+            param_type != "imputer":
+        return False
+    if config.get("sample_posterior") or config.get("add_indicator") or config.get("keep_empty_features"):
+        return False
+    if "missing_values" in config and not pd.isna(config["missing_values"]):
+        return False
+    # Random feature orders or neighbour features only replay round by round with an integer seed
+    uses_random_state = config.get("imputation_order", "ascending") == "random" or \
+        config.get("n_nearest_features") is not None
+    if uses_random_state and not isinstance(config.get("random_state"), (int, np.integer)):
+        return False
+    return not train_df.isna().all(axis=0).any()
+
+
+def fit_mice_sweep(imputers: list,
+                   max_iter_range: list,
+                   imputation_data: dict) -> list[tuple[Any, dict]]:
+    longest_pos = int(np.argmax(max_iter_range))
+    with stage("fit", rows=imputation_data["train_df"].shape[0]):
+        longest_imputer = imputers[longest_pos].fit(imputation_data["train_df"])
+    with stage("mice_round_snapshots", rows=imputation_data["missing_df"].shape[0]):
+        round_snapshots = mice_round_snapshots(longest_imputer, imputation_data["missing_df"].to_numpy(dtype=float))
+
+    sweep_results = []
+    for pos, max_iter in enumerate(max_iter_range):
+        imputer = longest_imputer if pos == longest_pos else truncate_iterative_imputer(longest_imputer, max_iter)
+        with stage("evaluate", rows=imputation_data["missing_df"].shape[0]):
+            sweep_results.append((imputer, evaluate_imputation(round_snapshots[imputer.n_iter_], imputation_data)))
+    return sweep_results
+
+
+knn_sweep_weights = {
+    "kNN": "uniform",
+    "WkNN": "distance"
+}
+
+
+@instrumented("run_comparing")
 def run_comparing(labeled_df: pd.DataFrame,
                   random_missing_df: pd.DateOffset,
                   missing_vals_idxs: list,
@@ -60,30 +288,29 @@ def run_comparing(labeled_df: pd.DataFrame,
                   var_range: list,
                   config: dict,
                   estimator_config: dict = {},
-                  disable_scaling: bool = False) -> tuple[pd.DataFrame, dict]:
+                  disable_scaling: bool = False,
+                  n_jobs: int = 1,
+                  incremental_sweep: bool = True) -> tuple[pd.DataFrame, dict]:
+    if n_jobs < 1:
+        raise ValueError("n_jobs must be >= 1. The value of n_jobs was: {}".format(n_jobs))
+
     mse_df_dict = {
         var_name: [],
         "col": [],
         "val": []
     }
 
-    imputer_type_map = {
-        "kNN": lambda c, estimator_config: KNNImputer(weights="uniform", **c),
-        "WkNN": lambda c, estimator_config: KNNImputer(weights="distance", **c),
-        "MICE": lambda c, estimator_config: IterativeImputer(estimator=LinearRegression(**estimator_config), **c),
-        "MICE BR": lambda c, estimator_config: IterativeImputer(estimator=BayesianRidge(**estimator_config), **c),
-        "MICE RF": lambda c, estimator_config: IterativeImputer(estimator=RandomForestRegressor(**estimator_config),
-                                                                **c),
-    }
-
     imputer_map = dict()
 
-    if (imputer_type == "kNN" or imputer_type == "WkNN") and not disable_scaling:
-        cols = set(missing_col_per_pos)
-        scaler = get_scaler(labeled_df, cols)
-        labeled_df = apply_scaler(labeled_df, scaler)
-        random_missing_df = apply_scaler(random_missing_df, scaler)
+    scale = get_imputer_info(imputer_type)["needs_scaling"] and not disable_scaling
+    with stage("prepare", rows=len(missing_vals_idxs)):
+        imputation_data = prepare_imputation(labeled_df, random_missing_df, missing_vals_idxs, missing_col_per_pos,
+                                             scale)
 
+    # Serial sweeps fit with the RandomStates of the configs themselves, parallel ones with seeds drawn
+    # from copies of them
+    random_state_copies = __random_state_copies__([config, estimator_config]) if n_jobs > 1 else dict()
+    sweep_imputers = []
     for curr_var_val in var_range:
         running_config = dict()
         running_config.update(config)
@@ -96,32 +323,35 @@ def run_comparing(labeled_df: pd.DataFrame,
         elif param_type == "estimator":
             running_estimator_config[var_param] = curr_var_val
 
-        imputer = imputer_type_map[imputer_type](running_config, running_estimator_config)
-        train_df = random_missing_df.loc[random_missing_df.index.difference(missing_vals_idxs)]
-        imputer = imputer.fit(train_df)
-
+        if n_jobs > 1:
+            running_config = __seed_from_random_state__(running_config, random_state_copies)
+            running_estimator_config = __seed_from_random_state__(running_estimator_config, random_state_copies)
+
+        imputer = make_imputer(imputer_type, running_config, running_estimator_config)
+        sweep_imputers.append((curr_var_val, imputer))
+
+    imputers = [imputer for _, imputer in sweep_imputers]
+    if incremental_sweep and can_sweep_knn_once(imputer_type, var_param, param_type, config,
+                                                imputation_data["train_df"]):
+        with stage("knn_sweep", rows=len(missing_vals_idxs) * len(imputers)):
+            sweep_results = fit_knn_sweep(imputers, list(var_range), knn_sweep_weights[imputer_type],
+                                          imputation_data)
+    elif incremental_sweep and can_warm_start_mice(imputer_type, var_param, param_type, config,
+                                                   imputation_data["train_df"]):
+        with stage("mice_sweep", rows=len(missing_vals_idxs) * len(imputers)):
+            sweep_results = fit_mice_sweep(imputers, list(var_range), imputation_data)
+    elif n_jobs == 1:
+        with stage("sweep", rows=len(missing_vals_idxs) * len(imputers)):
+            sweep_results = [fit_sweep_point(imputer, imputation_data) for imputer in imputers]
+    else:
+        # Stages of the worker processes are not recorded, only the whole pool
+        with stage("pool_sweep", rows=len(missing_vals_idxs) * len(imputers)):
+            sweep_results = run_sweep_in_pool(imputers, imputation_data, n_jobs)
+
+    for (curr_var_val, _), (imputer, sqr_err_dict) in zip(sweep_imputers, sweep_results):
         imputer_map[curr_var_val] = imputer
-        imputed_mat = imputer.transform(random_missing_df)
-
-        imputed_df = pd.DataFrame(imputed_mat, columns=labeled_df.columns, index=labeled_df.index)
-        imputed_df = imputed_df.loc[missing_vals_idxs]
-
-        temp_labeled_df = labeled_df
-
-        if (imputer_type == "kNN" or imputer_type == "WkNN") and not disable_scaling:
-            temp_labeled_df = unscale(labeled_df, scaler)
-            imputed_df = unscale(imputed_df, scaler)
 
         for col in labeled_df.columns:
-            imputed_df["{} (real)".format(col)] = temp_labeled_df[col]
-            imputed_df["{} (imputed)".format(col)] = imputed_df[col]
-            imputed_df.drop([col], axis=1, inplace=True)
-
-        imputed_df["imputed"] = missing_col_per_pos
-
-        sqr_err_dict = imputed_sqr_err(temp_labeled_df.columns, imputed_df)
-
-        for col in temp_labeled_df.columns:
             mse_df_dict["col"].append(col)
             mse_df_dict["val"].append(sqr_err_dict[col])
             mse_df_dict[var_name].append(curr_var_val)
@@ -129,6 +359,20 @@ def run_comparing(labeled_df: pd.DataFrame,
     mse_df = pd.DataFrame(mse_df_dict)
     return mse_df, imputer_map
 
+
+def run_sweep_in_pool(imputers: list, imputation_data: dict, n_jobs: int) -> list[tuple[Any, dict]]:
+    train_shm, train_spec = share_frame(imputation_data["train_df"])
+    missing_shm, missing_spec = share_frame(imputation_data["missing_df"])
+    # The frames travel through shared memory, the rest of the data is small enough to pickle
+    worker_data = {key: val for key, val in imputation_data.items() if key not in ("train_df", "missing_df")}
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=__init_sweep_worker__,
+                                 initargs=(train_spec, missing_spec, worker_data)) as executor:
+            return list(executor.map(__fit_sweep_point_in_worker__, imputers))
+    finally:
+        release_frames([train_shm, missing_shm])
+
+@instrumented("run")
 def run(
         labeled_df: pd.DataFrame,
         random_missing_df: pd.DateOffset,
@@ -137,22 +381,15 @@ def run(
         imputer_type: str,
         config: dict,
         estimator_config: dict = {}, 
-        disable_scaling: bool = False) -> tuple[pd.DataFrame, Any]:
-    
-    imputer_type_map = {
-        "kNN": lambda c, estimator_config: KNNImputer(weights="uniform", **c),
-        "WkNN": lambda c, estimator_config: KNNImputer(weights="distance", **c),
-        "MICE": lambda c, estimator_config: IterativeImputer(estimator=LinearRegression(**estimator_config), **c),
-        "MICE BR": lambda c, estimator_config: IterativeImputer(estimator=BayesianRidge(**estimator_config), **c),
-        "MICE RF": lambda c, estimator_config: IterativeImputer(estimator=RandomForestRegressor(**estimator_config),
-                                                                **c),
-    }
+        disable_scaling: bool = False,
+        cache_dir: str = None) -> tuple[pd.DataFrame, Any]:
+    # With cache_dir, the fitted imputer and its output are cached on disk by a hash of the data,
+    # the imputer type and the configs, see utils.imputer_cache
 
-    if (imputer_type == "kNN" or imputer_type == "WkNN") and not disable_scaling:
-        cols = set(missing_col_per_pos)
-        scaler = get_scaler(labeled_df, cols)
-        labeled_df = apply_scaler(labeled_df, scaler)
-        random_missing_df = apply_scaler(random_missing_df, scaler)
+    scale = get_imputer_info(imputer_type)["needs_scaling"] and not disable_scaling
+    with stage("prepare", rows=len(missing_vals_idxs)):
+        imputation_data = prepare_imputation(labeled_df, random_missing_df, missing_vals_idxs, missing_col_per_pos,
+                                             scale)
 
     running_config = dict()
     running_config.update(config)
@@ -160,49 +397,116 @@ def run(
     running_estimator_config = dict()
     running_estimator_config.update(estimator_config)
 
-    imputer = imputer_type_map[imputer_type](running_config, running_estimator_config)
-    train_df = random_missing_df.loc[random_missing_df.index.difference(missing_vals_idxs)]
-    imputer = imputer.fit(train_df)
+    configs = [running_config, running_estimator_config]
+    cached = None
+    if cache_dir is not None:
+        with stage("cache_load"):
+            cache_key = imputer_cache_key(imputation_data["train_df"], imputation_data["missing_df"], imputer_type,
+                                          running_config, running_estimator_config, imputation_data["scaler"])
+            cached = load_cached(cache_dir, cache_key, configs)
+
+    if cached is not None:
+        imputer, imputed_mat = cached
+    else:
+        imputer = make_imputer(imputer_type, running_config, running_estimator_config)
+        with stage("fit", rows=imputation_data["train_df"].shape[0]):
+            imputer = imputer.fit(imputation_data["train_df"])
+
+        with stage("transform", rows=imputation_data["missing_df"].shape[0]):
+            imputed_mat = imputer.transform(imputation_data["missing_df"])
+        if scale:
+            with stage("unscale", rows=imputed_mat.shape[0]):
+                unscale_values(imputed_mat, imputation_data["scaler"])
+        if cache_dir is not None:
+            with stage("cache_store"):
+                store_cached(cache_dir, cache_key, configs, imputer, imputed_mat)
+
+    with stage("output", rows=imputed_mat.shape[0]):
+        labeled_rows = imputation_data["labeled_rows"]
+        imputed_cols = dict()
+        for pos, col in enumerate(labeled_df.columns):
+            imputed_cols["{} (real)".format(col)] = labeled_rows[col].to_numpy()
+            imputed_cols["{} (imputed)".format(col)] = imputed_mat[:, pos]
+
+        imputed_df = pd.DataFrame(imputed_cols, index=labeled_rows.index)
+        imputed_df["imputed"] = missing_col_per_pos
 
-    imputed_mat = imputer.transform(random_missing_df)
+    return imputed_df, imputer
 
-    imputed_df = pd.DataFrame(imputed_mat, columns=labeled_df.columns, index=labeled_df.index)
-    imputed_df = imputed_df.loc[missing_vals_idxs]
+def read_csv_chunks(path: str, chunk_size: int, index_col: Any = 0) -> Iterator[pd.DataFrame]:
+    # round_trip parsing reads back exactly the floats to_csv wrote
+    with pd.read_csv(path, index_col=index_col, chunksize=chunk_size, float_precision="round_trip") as reader:
+        for chunk in reader:
+            yield chunk
 
-    if (imputer_type == "kNN" or imputer_type == "WkNN") and not disable_scaling:
-        labeled_df = unscale(labeled_df, scaler)
-        imputed_df = unscale(imputed_df, scaler)
 
-    for col in labeled_df.columns:
-        imputed_df["{} (real)".format(col)] = labeled_df[col]
-        imputed_df["{} (imputed)".format(col)] = imputed_df[col]
-        imputed_df.drop([col], axis=1, inplace=True)
+def impute_chunks(chunks: Iterable[pd.DataFrame], imputer: Any, scaler: dict = None) -> Iterator[pd.DataFrame]:
+    for chunk in chunks:
+        missing_rows = chunk.isna().any(axis=1).to_numpy()
+        if not missing_rows.any():
+            yield chunk
+            continue
 
-    imputed_df["imputed"] = missing_col_per_pos
+        missing_vals = chunk.loc[missing_rows].to_numpy(dtype=float, copy=True)
+        if scaler is not None:
+            scale_values(missing_vals, scaler)
 
-    return imputed_df, imputer
+        missing_df = pd.DataFrame(missing_vals, columns=chunk.columns, copy=False)
+        imputed_mat = imputer.transform(missing_df)
+        if scaler is not None:
+            unscale_values(imputed_mat, scaler)
+
+        chunk = chunk.astype(float)
+        chunk.loc[missing_rows] = imputed_mat
+        yield chunk
+
+
+def run_streaming(train_df: pd.DataFrame,
+                  input_path: str,
+                  output_path: str,
+                  imputer_type: str,
+                  config: dict,
+                  estimator_config: dict = {},
+                  disable_scaling: bool = False,
+                  scaler: dict = None,
+                  missing_cols: list = None,
+                  chunk_size: int = 10_000,
+                  index_col: Any = 0) -> Any:
+    # Fits on an in-memory training sample, then imputes input_path chunk by chunk into output_path,
+    # so peak memory depends on the training sample and chunk_size only. Imputers that need scaling use
+    # scaler if given, else one fitted as run() fits it: over the observed training cells of the columns
+    # that go missing, given as missing_cols since they are only known once every chunk was read.
+    # Imputers whose transform refits over the training rows would redo that fit for every chunk, so
+    # they are left to run().
+    imputer_info = get_imputer_info(imputer_type)
+    if imputer_info["transform_refits"]:
+        raise ValueError("{} refits on every transform, so it can't stream chunk by chunk, use run "
+                         "instead".format(imputer_type))
+    if imputer_info["needs_scaling"] and not disable_scaling:
+        train_vals = train_df.to_numpy(dtype=float, copy=True)
+        if scaler is None:
+            if missing_cols is None:
+                raise ValueError("{} scales its input, so it needs the columns that go missing (missing_cols) "
+                                 "or a scaler".format(imputer_type))
+            scaler = fit_scaler(train_vals, np.unique(__row_positions__(train_df.columns, missing_cols)))
+        scale_values(train_vals, scaler)
+        train_df = pd.DataFrame(train_vals, index=train_df.index, columns=train_df.columns, copy=False)
+    else:
+        scaler = None
+
+    running_config = dict()
+    running_config.update(config)
+
+    running_estimator_config = dict()
+    running_estimator_config.update(estimator_config)
+
+    imputer = make_imputer(imputer_type, running_config, running_estimator_config)
+    imputer = imputer.fit(train_df)
+
+    chunks = read_csv_chunks(input_path, chunk_size, index_col)
+    is_first_chunk = True
+    for imputed_chunk in impute_chunks(chunks, imputer, scaler):
+        imputed_chunk.to_csv(output_path, mode="w" if is_first_chunk else "a", header=is_first_chunk)
+        is_first_chunk = False
 
-def get_scaler(df: pd.DataFrame, cols: list[str]) -> dict:
-    col_scaler = dict()
-
-    for col in cols:
-        col_max = df[col].max()
-        col_min = df[col].min()
-        col_range = col_max - col_min
-        col_scaler[col] = (col_max, col_min, col_range)
-
-    return col_scaler
-
-def apply_scaler(df: pd.DataFrame, col_scaler: dict) -> pd.DataFrame:
-    df = df.copy()
-    for col in col_scaler.keys():
-        _, col_min, col_range = col_scaler[col]
-        df[col] = (df[col] - col_min) / col_range
-    return df
-
-def unscale(df: pd.DataFrame, col_scaler: dict) -> pd.DataFrame:
-    df = df.copy()
-    for col in col_scaler.keys():
-        _, col_min, col_range = col_scaler[col]
-        df[col] = df[col]*col_range + col_min
-    return df
\ No newline at end of file
+    return imputer
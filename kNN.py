@@ -1,10 +1,15 @@
 import random
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 import numpy as np
 import pandas as pd
 
+from utils.instrumentation import current_stage, instrumented, stage
+from utils.neighbour_index import build_mixed_index, build_neighbour_index, mixed_metrics
+from utils.scaling import fit_scaler
+
 
 def euclidean_distance(point1, point2) -> float:
     return np.sqrt(np.sum((point1 - point2) ** 2))
@@ -33,34 +38,83 @@ def find_max_prediction(predictions: dict[Any, tuple[float, Any]]) -> tuple[Any,
         return max_key, max_counts
 
 
+def add_vote(predictions: dict[Any, float], prediction_val: Any, dist: float, is_weighted: bool) -> None:
+    if is_weighted:
+        predictions[prediction_val] += 1 / (dist ** 2) if dist > 0 else float("inf")
+    else:
+        predictions[prediction_val] += 1
+
+
+def predict_cat(neighbour_vals, neighbour_dists, is_weighted: bool) -> tuple[Any, list[Any]]:
+    predictions = defaultdict(float)
+    for prediction_val, dist in zip(neighbour_vals, neighbour_dists):
+        add_vote(predictions, prediction_val, dist, is_weighted)
+    return find_max_prediction(predictions)
+
+
+def expand_cat_votes(sorted_vals, sorted_dists, k: int, is_weighted: bool) -> tuple[Any, list[Any], int]:
+    # Grows k over a neighbour stream sorted by distance, updating the tallies in place instead of
+    # recounting the first k neighbours for every new k. Returns the prediction (None if still tied at
+    # the end of the stream), the tied values and the expansions used.
+    predictions = defaultdict(float)
+    for prediction_val, dist in zip(sorted_vals[:k], sorted_dists[:k]):
+        add_vote(predictions, prediction_val, dist, is_weighted)
+    prediction, max_vals = find_max_prediction(predictions)
+
+    expansions = 0
+    for prediction_val, dist in zip(sorted_vals[k:], sorted_dists[k:]):
+        if prediction is not None:
+            break
+        add_vote(predictions, prediction_val, dist, is_weighted)
+        prediction, max_vals = find_max_prediction(predictions)
+        expansions += 1
+    return prediction, max_vals, expansions
+
+
+def expand_cat_prediction(sorted_vals, sorted_dists, k: int, is_weighted: bool) -> tuple[Any, int]:
+    prediction, max_vals, expansions = expand_cat_votes(sorted_vals, sorted_dists, k, is_weighted)
+    if prediction is None:
+        prediction = random.choice(max_vals)
+    return prediction, expansions
+
+
+def predict_qual(neighbour_vals, neighbour_dists, is_weighted: bool) -> tuple[Any, list[Any]]:
+    if is_weighted:
+        weights = [1 / (dist ** 2) for dist in neighbour_dists]
+        prediction_vals = [prediction_val * weight for prediction_val, weight in zip(neighbour_vals, weights)]
+        pred_avg = sum(prediction_vals) / sum(weights)
+        return pred_avg, [pred_avg]
+
+    prediction_vals = list(neighbour_vals)
+    pred_avg = sum(prediction_vals) / len(prediction_vals)
+    return pred_avg, [pred_avg]
+
+
+def predict(neighbour_vals, neighbour_dists, attr_to_predict: Any, attr_type: str,
+            is_weighted: bool) -> tuple[Any, list[Any]]:
+    if attr_type == "qualitative":
+        return predict_qual(neighbour_vals, neighbour_dists, is_weighted)
+
+    if attr_type == "categorical":
+        return predict_cat(neighbour_vals, neighbour_dists, is_weighted)
+
+    raise ValueError(f"attr type for {attr_to_predict} must have either categorical or qualitative attr type")
+
+
 def get_predictions_cat(distances: list[tuple[Any, float]],
                         train_df: pd.DataFrame,
                         attr_to_predict: Any,
                         is_weighted: bool) -> tuple[Any, list[Any]]:
-    predictions = defaultdict(float)
-    for idx, dist in distances:
-        prediction_val = train_df.loc[idx, attr_to_predict]
-        if is_weighted:
-            predictions[prediction_val] += 1 / (dist ** 2) if dist > 0 else float("inf")
-        else:
-            predictions[prediction_val] += 1
-    return find_max_prediction(predictions)
+    neighbour_vals = [train_df.loc[idx, attr_to_predict] for idx, _ in distances]
+    return predict_cat(neighbour_vals, [dist for _, dist in distances], is_weighted)
 
 
 def get_predictions_qual(distances: list[tuple[Any, float]],
                          train_df: pd.DataFrame,
                          attr_to_predict: Any,
                          is_weighted: bool) -> tuple[Any, list[Any]]:
-    if is_weighted:
-        weights = [(idx, 1 / (dist ** 2)) for idx, dist in distances]
-        prediction_vals = [train_df.loc[idx, attr_to_predict] * weight for idx, weight in weights]
-        dist_sum = sum(map(lambda w: w[1], weights))
-        pred_avg = sum(prediction_vals) / dist_sum
-        return pred_avg, [pred_avg]
-
-    prediction_vals = [train_df.loc[idx, attr_to_predict] for idx, _ in distances]
-    pred_avg = sum(prediction_vals) / len(prediction_vals)
-    return pred_avg, [pred_avg]
+    neighbour_vals = [train_df.loc[idx, attr_to_predict] for idx, _ in distances]
+    return predict_qual(neighbour_vals, [dist for _, dist in distances], is_weighted)
 
 
 def get_predictions(distances: list[tuple[Any, float]],
@@ -77,13 +131,29 @@ def get_predictions(distances: list[tuple[Any, float]],
     raise ValueError(f"attr type for {attr_to_predict} must have either categorical or qualitative attr type")
 
 
+tie_resolution_modes = ("incremental", "requery")
+
+
+def check_tie_resolution(tie_resolution: str) -> None:
+    if tie_resolution not in tie_resolution_modes:
+        raise ValueError(f"tie resolution must be one of {tie_resolution_modes}. The value was: {tie_resolution}")
+
+
 def get_prediction_for_test_row(train_df: pd.DataFrame,
                                 test_row: pd.Series,
                                 attr_to_predict: Any,
                                 attr_type: str,
-                                k: int, is_weighted: bool) -> Any:
+                                k: int, is_weighted: bool,
+                                tie_resolution: str = "incremental") -> Any:
+    check_tie_resolution(tie_resolution)
     distances = calculate_distances(train_df, test_row, attr_to_predict, k)
     prediction, max_vals = get_predictions(distances, train_df, attr_to_predict, attr_type, is_weighted)
+    if prediction is None and tie_resolution == "incremental":
+        distances = calculate_distances(train_df, test_row, attr_to_predict, train_df.shape[0])
+        sorted_vals = [train_df.loc[idx, attr_to_predict] for idx, _ in distances]
+        prediction, _ = expand_cat_prediction(sorted_vals, [dist for _, dist in distances], k, is_weighted)
+        return prediction
+
     new_k = k + 1
     while prediction is None and new_k <= train_df.shape[0]:
         distances = calculate_distances(train_df, test_row, attr_to_predict, new_k)
@@ -94,16 +164,144 @@ def get_prediction_for_test_row(train_df: pd.DataFrame,
     return prediction
 
 
+def build_feature_matrices(train_df: pd.DataFrame, test_df: pd.DataFrame, attr_to_predict: Any
+                           ) -> tuple[np.ndarray, np.ndarray]:
+    feature_cols = train_df.columns.drop(attr_to_predict)
+    train_features = train_df[feature_cols].to_numpy(dtype=float)
+    test_features = test_df.reindex(columns=feature_cols).to_numpy(dtype=float)
+    return train_features, test_features
+
+
+def build_attr_engine(train_df: pd.DataFrame, test_df: pd.DataFrame, attr_to_predict: Any,
+                      attr_types: dict[Any, str], index_type: str, metric: str, col_ranges: dict,
+                      index_params: dict = None) -> tuple[Any, np.ndarray, np.ndarray]:
+    train_features, test_features = build_feature_matrices(train_df, test_df, attr_to_predict)
+    if metric == "euclidean":
+        query = build_neighbour_index(train_features, index_type, index_params=index_params)
+    else:
+        # Feature columns missing from attr_types are taken as qualitative
+        feature_cols = train_df.columns.drop(attr_to_predict)
+        is_categorical = np.array([attr_types.get(col) == "categorical" for col in feature_cols], dtype=bool)
+        query = build_mixed_index(train_features, is_categorical, [col_ranges[col] for col in feature_cols], metric)
+    return query, test_features, train_df[attr_to_predict].to_numpy()
+
+
+def predict_attr_group(query: Any, test_features: np.ndarray, train_vals: np.ndarray,
+                       attr_to_predict: Any, attr_type: str, k: int, is_weighted: bool,
+                       tie_resolution: str, batch_size: int) -> tuple[list, list, list]:
+    # Predicts every row of test_features, batch_size rows per neighbour query. Rows still tied once
+    # every training row is a neighbour get None, with their tied values in the second list.
+    train_size = train_vals.shape[0]
+    predictions = [None] * test_features.shape[0]
+    tied_vals = [None] * test_features.shape[0]
+    expansions = [0] * test_features.shape[0]
+
+    for batch_start in range(0, test_features.shape[0], batch_size):
+        batch_features = test_features[batch_start:batch_start + batch_size]
+        neighbour_pos, neighbour_dists = query(batch_features, k)
+
+        tied_rows = []
+        for i in range(batch_features.shape[0]):
+            prediction, max_vals = predict(train_vals[neighbour_pos[i]], neighbour_dists[i],
+                                           attr_to_predict, attr_type, is_weighted)
+            predictions[batch_start + i] = prediction
+            tied_vals[batch_start + i] = max_vals
+            if prediction is None:
+                tied_rows.append(i)
+        if not tied_rows:
+            continue
+
+        if tie_resolution == "incremental":
+            sorted_pos, sorted_dists = query(batch_features[tied_rows], train_size)
+            for tied_pos, i in enumerate(tied_rows):
+                predictions[batch_start + i], tied_vals[batch_start + i], expansions[batch_start + i] = \
+                    expand_cat_votes(train_vals[sorted_pos[tied_pos]], sorted_dists[tied_pos], k, is_weighted)
+            continue
+
+        for i in tied_rows:
+            prediction, max_vals = None, tied_vals[batch_start + i]
+            new_k = k + 1
+            while prediction is None and new_k <= train_size:
+                tie_pos, tie_dists = query(batch_features[i:i + 1], new_k)
+                prediction, max_vals = predict(train_vals[tie_pos[0]], tie_dists[0],
+                                               attr_to_predict, attr_type, is_weighted)
+                new_k += 1
+            predictions[batch_start + i] = prediction
+            tied_vals[batch_start + i] = max_vals
+            expansions[batch_start + i] = new_k - k - 1
+
+    return predictions, tied_vals, expansions
+
+
+def check_metric(metric: str, index_type: str) -> None:
+    if metric != "euclidean" and metric not in mixed_metrics:
+        raise ValueError(f"metric must be euclidean or one of {mixed_metrics}. The value was: {metric}")
+    if metric != "euclidean" and index_type != "brute":
+        raise ValueError(f"the {metric} metric only supports the brute index type. The value was: {index_type}")
+
+
+@instrumented("kNN")
 def kNN(train_df: pd.DataFrame, test_df: pd.DataFrame,
         missing_vals: dict, attr_types: dict[Any, str],
-        k: int, is_weighted: bool = False) -> pd.DataFrame:
+        k: int, is_weighted: bool = False,
+        index_type: str = "brute", batch_size: int = 64,
+        tie_resolution: str = "incremental", record_expansions: bool = False,
+        metric: str = "euclidean", col_ranges: dict = None, n_threads: int = 1,
+        index_params: dict = None) -> pd.DataFrame:
+    # metric "heom"/"gower" compares the categorical columns of attr_types by equality and the others by
+    # their difference over col_ranges, which defaults to the ranges of the observed training values.
+    # index_type "lsh" searches approximately, index_params trading its recall for speed.
     if k > len(train_df):
         raise ValueError(f"k should be smaller than the total amount of points {len(train_df)}")
+    check_tie_resolution(tie_resolution)
+    check_metric(metric, index_type)
+    if n_threads < 1:
+        raise ValueError(f"n_threads must be >= 1. The value was: {n_threads}")
+    if metric != "euclidean" and col_ranges is None:
+        train_vals = train_df.to_numpy(dtype=float)
+        col_ranges = dict(zip(train_df.columns, fit_scaler(train_vals, np.arange(train_vals.shape[1]))["range"]))
 
     test_df_copy = test_df.copy()
-    predictions = [get_prediction_for_test_row(train_df, test_row, missing_vals[test_row_idx],
-                                               attr_types[missing_vals[test_row_idx]], k, is_weighted)
-                   for test_row_idx, test_row in test_df_copy.iterrows()]
+    test_attrs = np.array([missing_vals[test_row_idx] for test_row_idx in test_df_copy.index], dtype=object)
+
+    knn_stage = current_stage()
+
+    def predict_group(attr_to_predict: Any) -> tuple[np.ndarray, tuple[list, list, list]]:
+        # Rows sharing the attribute to predict share one feature matrix and neighbour index
+        group_pos = np.flatnonzero(test_attrs == attr_to_predict)
+        with stage("group", rows=group_pos.size, parent=knn_stage, attr=str(attr_to_predict)):
+            with stage("build_engine", rows=train_df.shape[0]):
+                query, test_features, train_vals = build_attr_engine(train_df, test_df_copy.iloc[group_pos],
+                                                                     attr_to_predict, attr_types, index_type, metric,
+                                                                     col_ranges, index_params)
+            with stage("predict", rows=group_pos.size):
+                return group_pos, predict_attr_group(query, test_features, train_vals, attr_to_predict,
+                                                     attr_types[attr_to_predict], k, is_weighted, tie_resolution,
+                                                     batch_size)
+
+    attrs_to_predict = list(dict.fromkeys(test_attrs))
+    if n_threads > 1:
+        # The neighbour queries are NumPy kernels that release the GIL, so groups overlap on threads
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            group_results = list(executor.map(predict_group, attrs_to_predict))
+    else:
+        group_results = [predict_group(attr_to_predict) for attr_to_predict in attrs_to_predict]
+
+    predictions = [None] * test_df_copy.shape[0]
+    tied_vals = [None] * test_df_copy.shape[0]
+    expansions = [0] * test_df_copy.shape[0]
+    for group_pos, (group_predictions, group_tied_vals, group_expansions) in group_results:
+        for i, test_pos in enumerate(group_pos):
+            predictions[test_pos] = group_predictions[i]
+            tied_vals[test_pos] = group_tied_vals[i]
+            expansions[test_pos] = group_expansions[i]
+
+    # Ties left are broken at random in the order of the test rows, whatever order the groups ran in
+    for test_pos, prediction in enumerate(predictions):
+        if prediction is None:
+            predictions[test_pos] = random.choice(tied_vals[test_pos])
 
     test_df_copy['predictions'] = predictions
+    if record_expansions:
+        test_df_copy['expansions'] = expansions
     return test_df_copy
@@ -0,0 +1,144 @@
+import time
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.utils import check_random_state
+
+
+def bin_thresholds(col_vals: np.ndarray, max_bins: int = None) -> np.ndarray:
+    # Columns with at most max_bins distinct values (any number if max_bins is None) are split between
+    # consecutive values, which keeps every split a tree could make on them. Others are cut at quantiles.
+    observed = col_vals[~np.isnan(col_vals)]
+    uniques = np.unique(observed)
+    if max_bins is None or uniques.size <= max_bins:
+        return (uniques[:-1] + uniques[1:]) / 2
+    return np.unique(np.quantile(observed, np.linspace(0, 1, max_bins + 1)[1:-1]))
+
+
+def bin_values(vals: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    return np.searchsorted(thresholds, vals, side="right").astype(np.float32)
+
+
+class MissForest:
+    # MissForest (Stekhoven & Buehlmann): starting from mean/mode imputation, every column with missing
+    # values is predicted by a random forest on the other columns, from the column with the fewest missing
+    # values to the one with the most, round after round until the change between rounds grows.
+    # fit keeps the training rows, transform imputes X together with them. Trees are fitted on binned
+    # features, which are updated only where imputed values change instead of rebuilt every round.
+    # As the forests learn from X too, nothing of a transform carries over to the next one: every call
+    # costs a whole run over the training rows and X, so impute everything in one call rather than chunks.
+    def __init__(self, max_iter: int = 10, categorical_cols: list = None, max_bins: int = 255,
+                 forest_params: dict = None, n_jobs: int = None, random_state: Any = None, verbose: int = 0):
+        self.max_iter = max_iter
+        self.categorical_cols = categorical_cols
+        self.max_bins = max_bins
+        self.forest_params = forest_params
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.verbose = verbose
+
+    def __categorical_mask__(self, X: Any, n_features: int) -> np.ndarray:
+        is_categorical = np.zeros(n_features, dtype=bool)
+        if not self.categorical_cols:
+            return is_categorical
+        cols = list(self.categorical_cols)
+        if isinstance(X, pd.DataFrame) and not all(isinstance(col, (int, np.integer)) for col in cols):
+            col_pos = X.columns.get_indexer(cols)
+            if (col_pos < 0).any():
+                raise KeyError(cols[int(np.flatnonzero(col_pos < 0)[0])])
+        else:
+            col_pos = np.asarray(cols, dtype=np.intp)
+        is_categorical[col_pos] = True
+        return is_categorical
+
+    def fit(self, X: Any, y: Any = None) -> "MissForest":
+        if self.max_iter < 1:
+            raise ValueError("max_iter must be >= 1. The value of max_iter was: {}".format(self.max_iter))
+        self.fit_X_ = np.array(X, dtype=float)
+        self.is_categorical_ = self.__categorical_mask__(X, self.fit_X_.shape[1])
+        return self
+
+    def transform(self, X: Any) -> np.ndarray:
+        X = np.array(X, dtype=float)
+        if not np.isnan(X).any():
+            return X
+        return self.__impute__(np.vstack([self.fit_X_, X]))[self.fit_X_.shape[0]:]
+
+    def fit_transform(self, X: Any, y: Any = None) -> np.ndarray:
+        return self.fit(X).__impute__(self.fit_X_.copy())
+
+    def __initial_imputation__(self, X: np.ndarray, mask: np.ndarray) -> None:
+        for col in range(X.shape[1]):
+            observed = X[~mask[:, col], col]
+            if not observed.size:
+                raise ValueError("column {} has no observed values to impute from".format(col))
+            if self.is_categorical_[col]:
+                vals, counts = np.unique(observed, return_counts=True)
+                X[mask[:, col], col] = vals[np.argmax(counts)]
+            else:
+                X[mask[:, col], col] = observed.mean()
+
+    def __make_forest__(self, col: int, random_generator: np.random.RandomState) -> Any:
+        forest_type = RandomForestClassifier if self.is_categorical_[col] else RandomForestRegressor
+        forest_params = dict(self.forest_params or {})
+        forest_params.setdefault("n_jobs", self.n_jobs)
+        forest_params["random_state"] = random_generator.randint(np.iinfo(np.int32).max)
+        return forest_type(**forest_params)
+
+    def __impute__(self, X: np.ndarray) -> np.ndarray:
+        mask = np.isnan(X)
+        self.__initial_imputation__(X, mask)
+        random_generator = check_random_state(self.random_state)
+
+        thresholds = [bin_thresholds(X[~mask[:, col], col], self.max_bins) for col in range(X.shape[1])]
+        binned_X = np.empty(X.shape, dtype=np.float32)
+        for col in range(X.shape[1]):
+            binned_X[:, col] = bin_values(X[:, col], thresholds[col])
+
+        missing_counts = mask.sum(axis=0)
+        # Stable, so columns missing as often are taken left to right
+        col_order = [col for col in np.argsort(missing_counts, kind="stable") if missing_counts[col]]
+        col_rows = {col: (np.flatnonzero(~mask[:, col]), np.flatnonzero(mask[:, col])) for col in col_order}
+        feature_cols = {col: np.delete(np.arange(X.shape[1]), col) for col in col_order}
+        num_cols = np.flatnonzero(~self.is_categorical_)
+        cat_cols = np.flatnonzero(self.is_categorical_)
+        num_missing_count = missing_counts[num_cols].sum()
+        cat_missing_count = missing_counts[cat_cols].sum()
+
+        self.iteration_log_ = []
+        prev_num_diff, prev_cat_diff = np.inf, np.inf
+        for iteration in range(self.max_iter):
+            start = time.perf_counter()
+            prev_X = X.copy()
+            for col in col_order:
+                observed_rows, missing_rows = col_rows[col]
+                forest = self.__make_forest__(col, random_generator)
+                forest.fit(binned_X[np.ix_(observed_rows, feature_cols[col])], X[observed_rows, col])
+                predicted = forest.predict(binned_X[np.ix_(missing_rows, feature_cols[col])])
+                X[missing_rows, col] = predicted
+                binned_X[missing_rows, col] = bin_values(predicted, thresholds[col])
+
+            num_sqr_sum = (X[:, num_cols] ** 2).sum()
+            num_diff = ((X[:, num_cols] - prev_X[:, num_cols]) ** 2).sum() / num_sqr_sum if num_sqr_sum else 0.0
+            cat_diff = (X[:, cat_cols] != prev_X[:, cat_cols]).sum() / cat_missing_count if cat_missing_count else 0.0
+            self.iteration_log_.append({
+                "iteration": iteration + 1,
+                "seconds": time.perf_counter() - start,
+                "numeric_diff": num_diff,
+                "categorical_diff": cat_diff
+            })
+            if self.verbose:
+                print("Iteration {}: {:.2f}s, numeric diff {:.6g}, categorical diff {:.6g}".format(
+                    iteration + 1, self.iteration_log_[-1]["seconds"], num_diff, cat_diff))
+
+            # Stops once the change stopped shrinking for every column type, keeping the previous round
+            if (not num_missing_count or num_diff >= prev_num_diff) and \
+                    (not cat_missing_count or cat_diff >= prev_cat_diff):
+                X = prev_X
+                break
+            prev_num_diff, prev_cat_diff = num_diff, cat_diff
+
+        self.n_iter_ = len(self.iteration_log_)
+        return X
@@ -0,0 +1,90 @@
+import glob
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.neighbour_index import build_neighbour_index
+from utils.scaling import fit_scaler, scale_values
+
+DEFAULT_LSH_PARAMS_GRID = [
+    {"n_tables": 2, "n_bits": 8},
+    {"n_tables": 4, "n_bits": 8},
+    {"n_tables": 8, "n_bits": 6},
+    {"n_tables": 16, "n_bits": 6},
+    {"n_tables": 16, "n_bits": 4},
+]
+
+
+def neighbour_recall(exact_dists: np.ndarray, approx_dists: np.ndarray) -> float:
+    # Share of the approximate neighbours no farther than the exact k-th neighbour, so that a point
+    # tied with the k-th neighbour counts as found whichever of the tied points the exact engine kept
+    kth_dists = exact_dists[:, -1:]
+    return float((approx_dists <= kth_dists * (1 + 1e-12)).mean())
+
+
+def measure_recall(train_features: np.ndarray, test_features: np.ndarray, k: int,
+                   index_type: str = "lsh", index_params_grid: list[dict] = None) -> pd.DataFrame:
+    if index_params_grid is None:
+        index_params_grid = DEFAULT_LSH_PARAMS_GRID
+
+    start = time.perf_counter()
+    _, exact_dists = build_neighbour_index(train_features)(test_features, k)
+    exact_seconds = time.perf_counter() - start
+
+    report_dict = {
+        "index_params": [],
+        "recall": [],
+        "exact_seconds": [],
+        "build_seconds": [],
+        "query_seconds": []
+    }
+    for index_params in index_params_grid:
+        start = time.perf_counter()
+        approx_query = build_neighbour_index(train_features, index_type, index_params=index_params)
+        built = time.perf_counter()
+        _, approx_dists = approx_query(test_features, k)
+        report_dict["index_params"].append(index_params)
+        report_dict["recall"].append(neighbour_recall(exact_dists, approx_dists))
+        report_dict["exact_seconds"].append(exact_seconds)
+        report_dict["build_seconds"].append(built - start)
+        report_dict["query_seconds"].append(time.perf_counter() - built)
+
+    report_df = pd.DataFrame(report_dict)
+    # The index is built once per training set, so the query time is what grows with the test set
+    report_df["query_speedup"] = report_df["exact_seconds"] / report_df["query_seconds"]
+    return report_df
+
+
+def recall_report(data_dir: str = "data", k: int = 5, index_type: str = "lsh",
+                  index_params_grid: list[dict] = None, max_queries: int = 1000,
+                  random_state: int = 0) -> pd.DataFrame:
+    # Recall of the approximate index against the exact one on every {split}-train_df/{split}-test_df
+    # pair of data_dir, on min/max scaled features as the imputation runs them. Test sets larger than
+    # max_queries are sampled down.
+    report_dfs = []
+    for test_path in sorted(glob.glob(os.path.join(data_dir, "*-test_df.csv"))):
+        split = os.path.basename(test_path)[:-len("-test_df.csv")]
+        train_vals = pd.read_csv(os.path.join(data_dir, "{}-train_df.csv".format(split)), index_col=0) \
+            .to_numpy(dtype=float)
+        test_df = pd.read_csv(test_path, index_col=0)
+        if test_df.shape[0] > max_queries:
+            test_df = test_df.sample(n=max_queries, random_state=random_state)
+        test_vals = test_df.to_numpy(dtype=float)
+
+        scaler = fit_scaler(train_vals, np.arange(train_vals.shape[1]))
+        scale_values(train_vals, scaler)
+        scale_values(test_vals, scaler)
+
+        report_df = measure_recall(train_vals, test_vals, min(k, train_vals.shape[0]), index_type, index_params_grid)
+        report_df.insert(0, "split", split)
+        report_df.insert(1, "train_size", train_vals.shape[0])
+        report_df.insert(2, "test_size", test_vals.shape[0])
+        report_dfs.append(report_df)
+
+    return pd.concat(report_dfs, ignore_index=True)
+
+
+if __name__ == "__main__":
+    print(recall_report().to_string())
@@ -0,0 +1,389 @@
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+# Benchmarks of the imputation hot paths, run from the repository root:
+#
+#   python -m utils.benchmark --sizes 10000 100000 1000000 --output bench.json
+#   python -m utils.benchmark --save-baseline          # stores the run as the baseline
+#   python -m utils.benchmark                          # fails when slower than the baseline
+#
+# Every case runs in a fresh process, so its peak RSS is its own. Datasets are the shipped
+# {split}-train_df/{split}-test_df pairs of data_dir ("split-5") and synthetic frames resampled from them
+# ("synthetic-100000"). The timed rows are the imputed rows for kNN and the imputers, whose test rows are
+# capped at max_test_rows, and every row of the frame for the others.
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_RSS_TOLERANCE = 0.25
+
+# Imputers are benchmarked with small configs, so large frames stay within reach
+__imputer_configs__ = {
+    "kNN": ({"n_neighbors": 5}, {}),
+    "WkNN": ({"n_neighbors": 5}, {}),
+    "MICE": ({"max_iter": 10, "random_state": 0}, {}),
+    "MICE BR": ({"max_iter": 10, "random_state": 0}, {}),
+    "MICE RF": ({"max_iter": 3, "random_state": 0},
+                {"n_estimators": 10, "max_depth": 10, "max_samples": 0.5, "random_state": 0}),
+    "custom kNN": ({"k": 5}, {}),
+    "LSH kNN": ({"k": 5}, {}),
+    "MissForest": ({"max_iter": 3, "random_state": 0}, {"n_estimators": 10, "max_depth": 10}),
+    "missingpy MissForest": ({"max_iter": 3, "random_state": 0}, {"n_estimators": 10, "max_depth": 10})
+}
+
+# (var_param, param_type, var_range) swept by run_comparing, by imputer type
+__imputer_sweeps__ = {
+    "kNN": ("n_neighbors", "imputer", [1, 3, 5, 10]),
+    "WkNN": ("n_neighbors", "imputer", [1, 3, 5, 10]),
+    "MICE": ("max_iter", "imputer", [1, 5, 10]),
+    "MICE BR": ("max_iter", "imputer", [1, 5, 10]),
+    "MICE RF": ("max_iter", "imputer", [1, 2, 3]),
+    "custom kNN": ("k", "imputer", [1, 3, 5, 10]),
+    "LSH kNN": ("k", "imputer", [1, 3, 5, 10]),
+    "MissForest": ("max_iter", "imputer", [1, 2, 3]),
+    "missingpy MissForest": ("max_iter", "imputer", [1, 2, 3])
+}
+
+
+def __read_json__(path: str) -> Any:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def __split_frames__(data_dir: str, split: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    train_df = pd.read_csv(os.path.join(data_dir, "{}-train_df.csv".format(split)), index_col=0)
+    test_df = pd.read_csv(os.path.join(data_dir, "{}-test_df.csv".format(split)), index_col=0)
+    return train_df, test_df
+
+
+def synthetic_frame(size: int, data_dir: str = "data", random_state: int = 0) -> pd.DataFrame:
+    # Rows of the 5 split resampled with replacement. The qualitative columns get a small jitter so the
+    # copies of a row are not exact duplicates, which would turn the neighbour searches into tie-breaking.
+    source_df = pd.concat(__split_frames__(data_dir, "5"))
+    random_generator = np.random.default_rng(random_state)
+    vals = source_df.to_numpy(dtype=float)[random_generator.integers(0, source_df.shape[0], size)]
+    for col in __read_json__(os.path.join(data_dir, "qualitative_cols.json")):
+        col_pos = source_df.columns.get_loc(col)
+        vals[:, col_pos] += random_generator.normal(0, 0.01 * np.nanstd(vals[:, col_pos]), size)
+    return pd.DataFrame(vals, columns=source_df.columns)
+
+
+def load_dataset(dataset: str, data_dir: str = "data", max_test_rows: int = 1000,
+                 random_state: int = 0) -> tuple[pd.DataFrame, pd.DataFrame]:
+    kind, _, name = dataset.partition("-")
+    if kind == "split":
+        train_df, test_df = __split_frames__(data_dir, name)
+        if test_df.shape[0] > max_test_rows:
+            test_df = test_df.sample(n=max_test_rows, random_state=random_state)
+        return train_df, test_df
+    if kind == "synthetic":
+        frame_df = synthetic_frame(int(name), data_dir, random_state)
+        test_size = min(frame_df.shape[0] // 5, max_test_rows)
+        return frame_df.iloc[:-test_size], frame_df.iloc[-test_size:]
+    raise ValueError("dataset must be split-<split> or synthetic-<rows>. The value of dataset was: {}".format(dataset))
+
+
+def __forget__(test_df: pd.DataFrame, data_dir: str, random_state: int) -> tuple[pd.DataFrame, list, list]:
+    from utils.forgetter import forget_random_col_per_sample_2
+    weight_map = dict.fromkeys(__read_json__(os.path.join(data_dir, "qualitative_cols.json")), 1)
+    missing_df, _, missing_vals_idxs, picked_cols = forget_random_col_per_sample_2(
+        test_df, weight_map, np.random.default_rng(random_state))
+    return missing_df, missing_vals_idxs, picked_cols
+
+
+# Setups take (train_df, test_df, data_dir, random_state) and return the callable to time and the rows it
+# processes. The work they do before returning is not timed.
+
+def __knn_setup__(train_df: pd.DataFrame, test_df: pd.DataFrame, data_dir: str,
+                  random_state: int) -> tuple[Callable[[], Any], int]:
+    from kNN import kNN
+    missing_df, missing_vals_idxs, picked_cols = __forget__(test_df, data_dir, random_state)
+    missing_vals = dict(zip(missing_vals_idxs, picked_cols))
+    attr_types = dict.fromkeys(__read_json__(os.path.join(data_dir, "qualitative_cols.json")), "qualitative")
+    return lambda: kNN(train_df, missing_df, missing_vals, attr_types, 5), missing_df.shape[0]
+
+
+def __imputation_args__(train_df: pd.DataFrame, test_df: pd.DataFrame, data_dir: str,
+                        random_state: int) -> tuple[pd.DataFrame, pd.DataFrame, list, list]:
+    missing_df, missing_vals_idxs, picked_cols = __forget__(test_df, data_dir, random_state)
+    return pd.concat([train_df, test_df]), pd.concat([train_df, missing_df]), missing_vals_idxs, picked_cols
+
+
+def __run_setup__(imputer_type: str) -> Callable:
+    def setup(train_df: pd.DataFrame, test_df: pd.DataFrame, data_dir: str,
+              random_state: int) -> tuple[Callable[[], Any], int]:
+        from imputation import run
+        args = __imputation_args__(train_df, test_df, data_dir, random_state)
+        config, estimator_config = __imputer_configs__.get(imputer_type, ({}, {}))
+        return lambda: run(*args, imputer_type, config, estimator_config), len(args[2])
+    return setup
+
+
+def __run_comparing_setup__(imputer_type: str) -> Callable:
+    def setup(train_df: pd.DataFrame, test_df: pd.DataFrame, data_dir: str,
+              random_state: int) -> tuple[Callable[[], Any], int]:
+        from imputation import run_comparing
+        args = __imputation_args__(train_df, test_df, data_dir, random_state)
+        config, estimator_config = __imputer_configs__.get(imputer_type, ({}, {}))
+        var_param, param_type, var_range = __imputer_sweeps__[imputer_type]
+        config = {key: val for key, val in config.items() if key != var_param}
+        return lambda: run_comparing(*args, imputer_type, var_param, param_type, var_param, var_range, config,
+                                     estimator_config), len(args[2]) * len(var_range)
+    return setup
+
+
+def __k_fold_setup__(train_df: pd.DataFrame, test_df: pd.DataFrame, data_dir: str,
+                     random_state: int) -> tuple[Callable[[], Any], int]:
+    from utils.data_split import k_fold_n_splits
+    frame_df = pd.concat([train_df, test_df])
+    return lambda: k_fold_n_splits(frame_df, 5, random_state=np.random.default_rng(random_state)), \
+        frame_df.shape[0]
+
+
+def __forget_setup__(train_df: pd.DataFrame, test_df: pd.DataFrame, data_dir: str,
+                     random_state: int) -> tuple[Callable[[], Any], int]:
+    frame_df = pd.concat([train_df, test_df])
+    return lambda: __forget__(frame_df, data_dir, random_state), frame_df.shape[0]
+
+
+def __labels__(train_df: pd.DataFrame, test_df: pd.DataFrame,
+               random_state: int) -> tuple[dict, dict, np.ndarray]:
+    # A binary column as the expected labels, predicted with a tenth of them flipped
+    expected_vals = np.where(pd.concat([train_df, test_df])["sex"].to_numpy() == 1, "P", "N")
+    random_generator = np.random.default_rng(random_state)
+    flipped = random_generator.random(expected_vals.size) < 0.1
+    predicted_vals = np.where(flipped, np.where(expected_vals == "P", "N", "P"), expected_vals)
+    idxs = range(expected_vals.size)
+    return dict(zip(idxs, predicted_vals)), dict(zip(idxs, expected_vals)), random_generator.random(expected_vals.size)
+
+
+def __confusion_matrix_setup__(train_df: pd.DataFrame, test_df: pd.DataFrame, data_dir: str,
+                               random_state: int) -> tuple[Callable[[], Any], int]:
+    import confusion_matrix as cm
+    predicted, expected, _ = __labels__(train_df, test_df, random_state)
+    labels = np.array(["P", "N"])
+
+    def bench() -> Any:
+        conf_mat = cm.calculate_confusion_matrix(labels, predicted, expected)
+        cm.calculate_relative_confusion_matrix_from_confusion_matrix(conf_mat)
+        cm.calculate_confusion_matrix_error_rate(conf_mat)
+        return cm.metrics(cm.calculate_per_label_confusion_matrix_from_confusion_matrix(conf_mat))
+    return bench, len(expected)
+
+
+def __roc_setup__(train_df: pd.DataFrame, test_df: pd.DataFrame, data_dir: str,
+                  random_state: int) -> tuple[Callable[[], Any], int]:
+    import confusion_matrix as cm
+    _, expected, scores = __labels__(train_df, test_df, random_state)
+    # Scores leaning towards the expected label, as a classifier's would
+    scores = np.clip(scores + np.where(np.array(list(expected.values())) == "P", 0.3, -0.3), 0, 1)
+    probas = {idx: {"P": score, "N": 1 - score} for idx, score in zip(expected.keys(), scores)}
+    thresholds = np.linspace(0, 1, 11)
+
+    def bench() -> Any:
+        roc_conf_mats = cm.calculate_roc_confusion_matrices(probas, expected, thresholds)
+        return cm.calculate_auc_from_positive_rates(cm.calculate_roc_positive_rates(roc_conf_mats))
+    return bench, len(expected)
+
+
+def benchmark_setups() -> dict[str, Callable]:
+    from utils.imputer_registry import imputer_registry
+    setups = {"kNN": __knn_setup__}
+    for imputer_type in imputer_registry:
+        setups["run[{}]".format(imputer_type)] = __run_setup__(imputer_type)
+        if imputer_type in __imputer_sweeps__:
+            setups["run_comparing[{}]".format(imputer_type)] = __run_comparing_setup__(imputer_type)
+    setups["k_fold_n_splits"] = __k_fold_setup__
+    setups["forget_random_col_per_sample_2"] = __forget_setup__
+    setups["confusion_matrix"] = __confusion_matrix_setup__
+    setups["roc"] = __roc_setup__
+    return setups
+
+
+def __peak_rss_bytes__() -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def run_case(benchmark: str, dataset: str, data_dir: str = "data", repeat: int = 3, max_test_rows: int = 1000,
+             random_state: int = 0) -> dict:
+    # Times benchmark on dataset repeat times, keeping the fastest run. Backends that are not installed
+    # make the case "skipped", other errors make it "failed".
+    result = {
+        "benchmark": benchmark,
+        "dataset": dataset
+    }
+    try:
+        train_df, test_df = load_dataset(dataset, data_dir, max_test_rows, random_state)
+        bench, rows = benchmark_setups()[benchmark](train_df, test_df, data_dir, random_state)
+        setup_rss = __peak_rss_bytes__()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            bench()
+            times.append(time.perf_counter() - start)
+    except ImportError as e:
+        result.update(status="skipped", error=repr(e))
+        return result
+    except Exception as e:
+        result.update(status="failed", error=repr(e))
+        return result
+
+    result.update(status="ok", rows=rows, seconds=min(times), seconds_all=times,
+                  rows_per_sec=rows / min(times) if min(times) else float("inf"),
+                  setup_rss_bytes=setup_rss, peak_rss_bytes=__peak_rss_bytes__())
+    return result
+
+
+def run_benchmarks(benchmarks: list[str], datasets: list[str], data_dir: str = "data", repeat: int = 3,
+                   max_test_rows: int = 1000, random_state: int = 0, isolate: bool = True,
+                   verbose: bool = True) -> list[dict]:
+    results = []
+    # A process per case, so the peak RSS of a case is not the one of the cases before it
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                   max_tasks_per_child=1) if isolate else None
+    try:
+        for dataset in datasets:
+            for benchmark in benchmarks:
+                args = (benchmark, dataset, data_dir, repeat, max_test_rows, random_state)
+                result = executor.submit(run_case, *args).result() if isolate else run_case(*args)
+                results.append(result)
+                if verbose:
+                    print(__format_result__(result), flush=True)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return results
+
+
+def __format_result__(result: dict) -> str:
+    name = "{} on {}".format(result["benchmark"], result["dataset"])
+    if result["status"] != "ok":
+        return "{:<60} {}: {}".format(name, result["status"], result["error"])
+    return "{:<60} {:>10.4f}s {:>14.1f} rows/s {:>8.1f} MiB".format(
+        name, result["seconds"], result["rows_per_sec"], result["peak_rss_bytes"] / (1 << 20))
+
+
+def environment_info() -> dict:
+    import sklearn
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+
+def compare_to_baseline(results: list[dict], baseline: dict, tolerance: float = DEFAULT_TOLERANCE,
+                        rss_tolerance: float = DEFAULT_RSS_TOLERANCE) -> list[str]:
+    # A case regresses when its time or peak RSS grew past the tolerance over the baseline's, or when
+    # it fails where the baseline ran. Cases missing from the baseline are not compared.
+    baseline_results = {(result["benchmark"], result["dataset"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get((result["benchmark"], result["dataset"]))
+        if baseline_result is None or baseline_result["status"] != "ok":
+            continue
+        name = "{} on {}".format(result["benchmark"], result["dataset"])
+        if result["status"] != "ok":
+            regressions.append("{} {}: {}".format(name, result["status"], result["error"]))
+            continue
+        if result["seconds"] > baseline_result["seconds"] * (1 + tolerance):
+            regressions.append("{} took {:.4f}s, {:.1%} more than the baseline's {:.4f}s".format(
+                name, result["seconds"], result["seconds"] / baseline_result["seconds"] - 1,
+                baseline_result["seconds"]))
+        if result["peak_rss_bytes"] > baseline_result["peak_rss_bytes"] * (1 + rss_tolerance):
+            regressions.append("{} peaked at {:.1f} MiB, {:.1%} more than the baseline's {:.1f} MiB".format(
+                name, result["peak_rss_bytes"] / (1 << 20),
+                result["peak_rss_bytes"] / baseline_result["peak_rss_bytes"] - 1,
+                baseline_result["peak_rss_bytes"] / (1 << 20)))
+    return regressions
+
+
+def __parse_args__(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m utils.benchmark",
+                                     description="Benchmarks the imputation hot paths.")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--splits", nargs="*", default=["5"],
+                        help="shipped splits to run on, 'all' for every one in data-dir")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[10 ** 4],
+                        help="rows of the synthetic frames, e.g. 10000 100000 1000000")
+    parser.add_argument("--benchmarks", nargs="*", default=["*"],
+                        help="glob patterns of the benchmarks to run, e.g. 'run*[kNN]' k_fold_n_splits")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-test-rows", type=int, default=1000)
+    parser.add_argument("--random-state", type=int, default=0)
+    parser.add_argument("--in-process", action="store_true",
+                        help="run every case in this process, peak RSS is then cumulative")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results as the baseline instead of comparing to it")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--rss-tolerance", type=float, default=DEFAULT_RSS_TOLERANCE)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None) -> int:
+    args = __parse_args__(sys.argv[1:] if argv is None else argv)
+    if args.repeat < 1:
+        raise ValueError("repeat must be >= 1. The value of repeat was: {}".format(args.repeat))
+
+    setups = benchmark_setups()
+    if args.list:
+        print("\n".join(setups))
+        return 0
+    benchmarks = [name for name in setups if any(fnmatch.fnmatchcase(name, pattern.replace("[", "[[]"))
+                                                 for pattern in args.benchmarks)]
+    splits = args.splits
+    if splits == ["all"]:
+        splits = sorted((name[:-len("-test_df.csv")] for name in os.listdir(args.data_dir)
+                         if name.endswith("-test_df.csv")), key=int)
+    datasets = ["split-{}".format(split) for split in splits] + ["synthetic-{}".format(size) for size in args.sizes]
+
+    results = run_benchmarks(benchmarks, datasets, args.data_dir, args.repeat, args.max_test_rows,
+                             args.random_state, isolate=not args.in_process)
+    report = {
+        "environment": environment_info(),
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Baseline written to {}".format(args.baseline))
+
+    failed = [result for result in results if result["status"] == "failed"]
+    regressions = []
+    if not args.save_baseline:
+        if os.path.exists(args.baseline):
+            regressions = compare_to_baseline(results, __read_json__(args.baseline), args.tolerance,
+                                              args.rss_tolerance)
+        else:
+            print("No baseline at {}, nothing to compare to".format(args.baseline))
+    for regression in regressions:
+        print("REGRESSION: {}".format(regression), file=sys.stderr)
+    for result in failed:
+        print("FAILED: {}".format(__format_result__(result)), file=sys.stderr)
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
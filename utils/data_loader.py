@@ -0,0 +1,189 @@
+import json
+import os
+import shutil
+import uuid
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+# Typed loading of data/thyroidDF.csv and the {split}-train_df/{split}-test_df files, with the column
+# types taken from data/categorical_cols.json and data/qualitative_cols.json:
+#   - qualitative columns, and the raw columns with a "<col>_measured" flag, are measurements in
+#     float_dtype (float64 by default, float32 halves them)
+#   - the t/f columns of thyroidDF.csv are bool, the 0/1 categorical columns of the splits uint8
+#   - sex, referral_source and target of thyroidDF.csv are categoricals
+#
+# The first load of a file parses the CSV and writes its columns as .npy blocks under cache_dir
+# (data/.cache by default). Later loads memory-map them instead of parsing, so only the pages a caller
+# touches are read in. The maps are copy-on-write: the frames can be edited in place like read_csv ones,
+# and the edits never reach the cache. A cache entry is rebuilt when its CSV changes size or modification time.
+
+__CACHE_VERSION__ = 1
+__CACHE_DIRNAME__ = ".cache"
+
+__THYROID_LABEL_COLS__ = ["sex", "referral_source", "target"]
+__THYROID_ID_COL__ = "patient_id"
+
+
+def __read_json__(path: str) -> Any:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def __check_float_dtype__(float_dtype: Any) -> np.dtype:
+    float_dtype = np.dtype(float_dtype)
+    if float_dtype not in (np.dtype(np.float32), np.dtype(np.float64)):
+        raise ValueError("float dtype must be float32 or float64. The value of float dtype was: {}".format(
+            float_dtype))
+    return float_dtype
+
+
+def thyroid_dtypes(columns: list, data_dir: str = "data", float_dtype: Any = np.float64) -> dict:
+    qualitative_cols = set(__read_json__(os.path.join(data_dir, "qualitative_cols.json")))
+    dtypes = dict()
+    for col in columns:
+        if col in qualitative_cols or "{}_measured".format(col) in columns:
+            dtypes[col] = float_dtype
+        elif col == __THYROID_ID_COL__:
+            dtypes[col] = np.int64
+        elif col in __THYROID_LABEL_COLS__:
+            dtypes[col] = "category"
+        else:
+            dtypes[col] = bool
+    return dtypes
+
+
+def split_dtypes(columns: list, data_dir: str = "data", float_dtype: Any = np.float64) -> dict:
+    categorical_cols = set(__read_json__(os.path.join(data_dir, "categorical_cols.json")))
+    return {col: np.uint8 if col in categorical_cols else float_dtype for col in columns}
+
+
+def __parse_thyroid__(path: str, data_dir: str, float_dtype: np.dtype) -> pd.DataFrame:
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    dtypes = thyroid_dtypes(columns, data_dir, float_dtype)
+    return pd.read_csv(path, dtype=dtypes, true_values=["t"], false_values=["f"])
+
+
+def __parse_split_file__(path: str, data_dir: str, float_dtype: np.dtype) -> pd.DataFrame:
+    df = pd.read_csv(path, index_col=0)
+    dtypes = split_dtypes(list(df.columns), data_dir, float_dtype)
+    for col, dtype in dtypes.items():
+        # 0/1 codes only, a categorical column with anything else stays a float one
+        if dtype == np.uint8 and not df[col].isin([0, 1]).all():
+            dtypes[col] = float_dtype
+    return df.astype(dtypes)
+
+
+def __source_stamp__(path: str) -> dict:
+    stat = os.stat(path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns
+    }
+
+
+def __entry_dir__(cache_dir: str, path: str, float_dtype: np.dtype) -> str:
+    return os.path.join(cache_dir, "{}.{}".format(os.path.basename(path), float_dtype.name))
+
+
+def __write_entry__(entry_dir: str, df: pd.DataFrame, source_stamp: dict) -> None:
+    # Columns of one dtype go into one (columns, rows) block, so a load maps a file per dtype rather than one
+    # per column, and every column stays contiguous. Categoricals are stored as their codes. Written into a
+    # temporary directory first and renamed into place, so readers never see a partial entry.
+    tmp_dir = "{}.{}.tmp".format(entry_dir, uuid.uuid4().hex)
+    os.makedirs(tmp_dir)
+    block_cols = dict()
+    col_specs = []
+    for col in df.columns:
+        vals = df[col]
+        categories = None
+        if isinstance(vals.dtype, pd.CategoricalDtype):
+            categories = vals.cat.categories.tolist()
+            vals = vals.cat.codes
+        vals = vals.to_numpy()
+        block_vals = block_cols.setdefault(vals.dtype.str, [])
+        col_specs.append({
+            "name": col,
+            "block": vals.dtype.str,
+            "pos": len(block_vals),
+            "categories": categories
+        })
+        block_vals.append(vals)
+    blocks = []
+    for block_pos, (dtype_str, block_vals) in enumerate(block_cols.items()):
+        np.save(os.path.join(tmp_dir, "block_{}.npy".format(block_pos)), np.stack(block_vals))
+        blocks.append(dtype_str)
+    np.save(os.path.join(tmp_dir, "index.npy"), df.index.to_numpy())
+    meta = {
+        "version": __CACHE_VERSION__,
+        "source": source_stamp,
+        "blocks": blocks,
+        "columns": col_specs,
+        "index_name": df.index.name
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    if os.path.isdir(entry_dir):
+        shutil.rmtree(entry_dir)
+    os.replace(tmp_dir, entry_dir)
+
+
+def __read_entry__(entry_dir: str, source_stamp: dict) -> pd.DataFrame:
+    # None when the entry is missing or was written for another version of the CSV
+    try:
+        meta = __read_json__(os.path.join(entry_dir, "meta.json"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if meta["version"] != __CACHE_VERSION__ or meta["source"] != source_stamp:
+        return None
+
+    blocks = {dtype_str: np.load(os.path.join(entry_dir, "block_{}.npy".format(block_pos)), mmap_mode="c")
+              for block_pos, dtype_str in enumerate(meta["blocks"])}
+    cols = dict()
+    for col_spec in meta["columns"]:
+        vals = blocks[col_spec["block"]][col_spec["pos"]]
+        if col_spec["categories"] is not None:
+            vals = pd.Categorical.from_codes(vals, dtype=pd.CategoricalDtype(col_spec["categories"]),
+                                             validate=False)
+        cols[col_spec["name"]] = vals
+    index = pd.Index(np.load(os.path.join(entry_dir, "index.npy"), mmap_mode="c"), name=meta["index_name"])
+    return pd.DataFrame(cols, index=index, copy=False)
+
+
+def __load__(path: str, parse: Callable[[str, str, np.dtype], pd.DataFrame], data_dir: str, float_dtype: Any,
+             cache: bool, cache_dir: str) -> pd.DataFrame:
+    float_dtype = __check_float_dtype__(float_dtype)
+    if not cache:
+        return parse(path, data_dir, float_dtype)
+    if cache_dir is None:
+        cache_dir = os.path.join(data_dir, __CACHE_DIRNAME__)
+
+    entry_dir = __entry_dir__(cache_dir, path, float_dtype)
+    source_stamp = __source_stamp__(path)
+    df = __read_entry__(entry_dir, source_stamp)
+    if df is None:
+        df = parse(path, data_dir, float_dtype)
+        os.makedirs(cache_dir, exist_ok=True)
+        __write_entry__(entry_dir, df, source_stamp)
+        df = __read_entry__(entry_dir, source_stamp)
+    return df
+
+
+def load_thyroid(data_dir: str = "data", float_dtype: Any = np.float64, cache: bool = True,
+                 cache_dir: str = None) -> pd.DataFrame:
+    return __load__(os.path.join(data_dir, "thyroidDF.csv"), __parse_thyroid__, data_dir, float_dtype, cache,
+                    cache_dir)
+
+
+def load_split(split: Any, data_dir: str = "data", float_dtype: Any = np.float64, cache: bool = True,
+               cache_dir: str = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # The (train_df, test_df) pair of a split, e.g. load_split(5) for 5-train_df.csv and 5-test_df.csv
+    return tuple(__load__(os.path.join(data_dir, "{}-{}_df.csv".format(split, part)), __parse_split_file__,
+                          data_dir, float_dtype, cache, cache_dir) for part in ("train", "test"))
+
+
+def clear_cache(data_dir: str = "data", cache_dir: str = None) -> None:
+    shutil.rmtree(os.path.join(data_dir, __CACHE_DIRNAME__) if cache_dir is None else cache_dir,
+                  ignore_errors=True)
@@ -1,64 +1,57 @@
-import math
-
 import numpy as np
 import pandas as pd
 
 
-def __shuffled_df_copy__(df: pd.DataFrame, random_state: np.random.Generator) -> pd.DataFrame:
-    df = df.copy()
-    df = df.sample(frac=1) if random_state is None \
-        else df.sample(frac=1, random_state=random_state)
-    return df
-
-
-def __create_k_empty_dfs_from_template__(template_df: pd.DataFrame, k: int) -> list[pd.DataFrame]:
-    dfs = []
-    for _ in range(k):
-        dfs.append(pd.DataFrame(columns=template_df.columns))
-    return dfs
-
+def __shuffled_positions__(size: int, random_state: np.random.Generator) -> np.ndarray:
+    # Sampling a range through pandas draws the same permutation df.sample(frac=1) would
+    positions = pd.Series(np.arange(size))
+    positions = positions.sample(frac=1) if random_state is None \
+        else positions.sample(frac=1, random_state=random_state)
+    return positions.to_numpy()
 
-def __calculate_fold_times__(df: pd.DataFrame, k: int) -> int:
-    df_size = df.shape[0]
-    fold_times = math.ceil(df_size / k)
-    return fold_times
 
-
-def __generate_k_folds__(df: pd.DataFrame, k: int, random_state: np.random.Generator = None) -> list[pd.DataFrame]:
-    if (k < 2): raise ValueError("k must be >= 2. The value of k was: {}".format(k))
-    df = __shuffled_df_copy__(df, random_state)
-    folds = __create_k_empty_dfs_from_template__(df, k)
-    fold_times = __calculate_fold_times__(df, k)
-    for i in range(fold_times):
-        curr_fold = df.iloc[i * k:(i + 1) * k]
-        for fold_idx in range(k):
-            folds[fold_idx] = pd.concat([folds[fold_idx], curr_fold.iloc[fold_idx].to_frame().T]) if curr_fold.shape[
-                                                                                                         0] > fold_idx \
-                else folds[fold_idx]
-    return folds
-
-
-def __generate_n_splits__(df: pd.DataFrame, k: int, folds: list[pd.DataFrame], n: int = None,
-                          random_state: np.random.Generator = None) -> list[tuple[pd.DataFrame, pd.DataFrame]]:
+def __choose_test_folds__(k: int, n: int = None, random_state: np.random.Generator = None) -> np.ndarray:
     if n is None:
         n = k
     if n < 1 or n > k:
         raise ValueError("n must be >= 1 and <= {}(=k). The value of n was: {}".format(k, n))
     if random_state is None:
         random_state = np.random.default_rng()
-
-    splits = []
     folds_idxs = np.array(range(k))
-    chosen_folds_idxs = random_state.choice(folds_idxs, size=n, replace=False)
+    return random_state.choice(folds_idxs, size=n, replace=False)
+
+
+def __split_idxs_for_test_folds__(fold_idxs: list[np.ndarray], test_folds: np.ndarray
+                                  ) -> list[tuple[np.ndarray, np.ndarray]]:
+    split_idxs = []
+    for chosen_fold_idx in test_folds:
+        test_idxs = fold_idxs[chosen_fold_idx]
+        train_idxs = np.concatenate([fold_idxs[fold_idx] for fold_idx in range(len(fold_idxs))
+                                     if fold_idx != chosen_fold_idx])
+        split_idxs.append((train_idxs, test_idxs))
+    return split_idxs
+
+
+def k_fold_draw(size: int, k: int, n: int = None, random_state: np.random.Generator = None
+                ) -> tuple[np.ndarray, np.ndarray]:
+    # The random draws of k_fold_n_split_idxs, in the same order: the shuffled positions that are dealt
+    # round-robin into the k folds, and the folds chosen as test folds
+    if (k < 2): raise ValueError("k must be >= 2. The value of k was: {}".format(k))
+    shuffled_positions = __shuffled_positions__(size, random_state)
+    return shuffled_positions, __choose_test_folds__(k, n, random_state)
+
+
+def k_fold_split_idxs_from_draw(shuffled_positions: np.ndarray, k: int, test_folds: np.ndarray
+                                ) -> list[tuple[np.ndarray, np.ndarray]]:
+    # Shuffled rows are dealt round-robin: fold i gets rows i, i + k, i + 2k, ...
+    fold_idxs = [shuffled_positions[fold_idx::k] for fold_idx in range(k)]
+    return __split_idxs_for_test_folds__(fold_idxs, test_folds)
 
-    for chosen_fold_idx in chosen_folds_idxs:
-        test_df = folds[chosen_fold_idx].copy()
-        train_df = pd.DataFrame(columns=df.columns)
-        for fold_idx in folds_idxs:
-            if fold_idx != chosen_fold_idx: train_df = pd.concat([train_df, folds[fold_idx]])
-        splits.append((train_df, test_df))
 
-    return splits
+def k_fold_n_split_idxs(size: int, k: int, n: int = None, random_state: np.random.Generator = None
+                        ) -> list[tuple[np.ndarray, np.ndarray]]:
+    shuffled_positions, test_folds = k_fold_draw(size, k, n, random_state)
+    return k_fold_split_idxs_from_draw(shuffled_positions, k, test_folds)
 
 
 def k_fold_split(df: pd.DataFrame, k: int, random_state: np.random.Generator = None
@@ -69,5 +62,5 @@ def k_fold_split(df: pd.DataFrame, k: int, random_state: np.random.Generator = N
 
 def k_fold_n_splits(df: pd.DataFrame, k: int, n: int = None, random_state: np.random.Generator = None
                     ) -> list[tuple[pd.DataFrame, pd.DataFrame]]:
-    folds = __generate_k_folds__(df, k, random_state)
-    return __generate_n_splits__(df, k, folds, n, random_state)
+    split_idxs = k_fold_n_split_idxs(df.shape[0], k, n, random_state)
+    return [(df.take(train_idxs), df.take(test_idxs)) for train_idxs, test_idxs in split_idxs]
@@ -3,31 +3,90 @@ from typing import Any
 import numpy as np
 import pandas as pd
 
+from utils.instrumentation import instrumented, stage
+from utils.missingness import block_mask, mar_mask, mcar_mask, missing_from_mask, mnar_mask, monotone_mask
 from utils.proba_utils import cum_sum_intervals_from_weights, sample_cols, create_nan_vals
 
 
+@instrumented("forget_random_col_per_sample")
 def forget_random_col_per_sample(remove_vals_df: pd.DataFrame,
                                  weight_map: dict[Any, int],
                                  random_generator: np.random.Generator
                                  ) -> tuple[pd.DataFrame, dict, list]:
     cum_sum_intervals, cum_sum_col_map = cum_sum_intervals_from_weights(weight_map)
 
-    picked_cols = sample_cols(remove_vals_df.shape[0], cum_sum_intervals, cum_sum_col_map, random_generator)
-    missing_vals_df, missing_col_map = create_nan_vals(remove_vals_df, picked_cols)
+    with stage("sample_cols", rows=remove_vals_df.shape[0]):
+        picked_cols = sample_cols(remove_vals_df.shape[0], cum_sum_intervals, cum_sum_col_map, random_generator)
+    with stage("create_nan_vals", rows=remove_vals_df.shape[0]):
+        missing_vals_df, missing_col_map = create_nan_vals(remove_vals_df, picked_cols)
 
     missing_vals_idxs = list(missing_vals_df.index)
 
     return missing_vals_df, missing_col_map, missing_vals_idxs
 
+@instrumented("forget_random_col_per_sample_2")
 def forget_random_col_per_sample_2(remove_vals_df: pd.DataFrame,
                                    weight_map: dict[Any, int],
                                    random_generator: np.random.Generator
                                    ) -> tuple[pd.DataFrame, dict, list, list]:
     cum_sum_intervals, cum_sum_col_map = cum_sum_intervals_from_weights(weight_map)
 
-    picked_cols = sample_cols(remove_vals_df.shape[0], cum_sum_intervals, cum_sum_col_map, random_generator)
-    missing_vals_df, missing_col_map = create_nan_vals(remove_vals_df, picked_cols)
+    with stage("sample_cols", rows=remove_vals_df.shape[0]):
+        picked_cols = sample_cols(remove_vals_df.shape[0], cum_sum_intervals, cum_sum_col_map, random_generator)
+    with stage("create_nan_vals", rows=remove_vals_df.shape[0]):
+        missing_vals_df, missing_col_map = create_nan_vals(remove_vals_df, picked_cols)
 
     missing_vals_idxs = list(missing_vals_df.index)
 
     return missing_vals_df, missing_col_map, missing_vals_idxs, picked_cols
+
+
+@instrumented("forget_mcar")
+def forget_mcar(remove_vals_df: pd.DataFrame,
+                rate: float,
+                random_generator: np.random.Generator,
+                cols: list = None
+                ) -> tuple[pd.DataFrame, dict, list, list]:
+    return missing_from_mask(remove_vals_df, mcar_mask(remove_vals_df, rate, random_generator, cols))
+
+
+@instrumented("forget_mar")
+def forget_mar(remove_vals_df: pd.DataFrame,
+               rate: float,
+               driver_cols: list,
+               random_generator: np.random.Generator,
+               cols: list = None,
+               strength: float = 1.0
+               ) -> tuple[pd.DataFrame, dict, list, list]:
+    nan_mask = mar_mask(remove_vals_df, rate, driver_cols, random_generator, cols, strength)
+    return missing_from_mask(remove_vals_df, nan_mask)
+
+
+@instrumented("forget_mnar")
+def forget_mnar(remove_vals_df: pd.DataFrame,
+                rate: float,
+                random_generator: np.random.Generator,
+                cols: list = None,
+                strength: float = 1.0
+                ) -> tuple[pd.DataFrame, dict, list, list]:
+    return missing_from_mask(remove_vals_df, mnar_mask(remove_vals_df, rate, random_generator, cols, strength))
+
+
+@instrumented("forget_monotone")
+def forget_monotone(remove_vals_df: pd.DataFrame,
+                    rate: float,
+                    random_generator: np.random.Generator,
+                    cols: list = None
+                    ) -> tuple[pd.DataFrame, dict, list, list]:
+    return missing_from_mask(remove_vals_df, monotone_mask(remove_vals_df, rate, random_generator, cols))
+
+
+@instrumented("forget_blocks")
+def forget_blocks(remove_vals_df: pd.DataFrame,
+                  rate: float,
+                  random_generator: np.random.Generator,
+                  cols: list = None,
+                  block_size: int = 10
+                  ) -> tuple[pd.DataFrame, dict, list, list]:
+    nan_mask = block_mask(remove_vals_df, rate, random_generator, cols, block_size)
+    return missing_from_mask(remove_vals_df, nan_mask)
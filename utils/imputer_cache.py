@@ -0,0 +1,161 @@
+import importlib.util
+import os
+import uuid
+from typing import Any
+
+import joblib
+import numpy as np
+import pandas as pd
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 2 << 30
+
+__CACHE_SUFFIX__ = ".joblib"
+
+# The first-party code fitted imputers come from. Its source is part of the key, so a change to it
+# doesn't serve imputers fitted by the old code.
+__IMPUTER_MODULES__ = ["utils.imputer_registry", "kNN", "utils.neighbour_index", "utils.scaling", "miss_forest"]
+__code_stamps__ = dict()
+
+# Lookups of this process, reported by cache_stats
+__cache_counts__ = {
+    "hits": 0,
+    "misses": 0
+}
+
+
+def __random_states__(configs: list[dict]) -> list[np.random.RandomState]:
+    random_states = dict()
+    for config in configs:
+        for val in config.values():
+            if isinstance(val, np.random.RandomState):
+                random_states[id(val)] = val
+    return list(random_states.values())
+
+
+def __frame_parts__(df: pd.DataFrame) -> list:
+    return [df.to_numpy(dtype=float), df.index, df.columns]
+
+
+def __code_stamp__() -> str:
+    # Hashed once per process, from the source files as they are found on the path
+    if "stamp" not in __code_stamps__:
+        sources = []
+        for module in __IMPUTER_MODULES__:
+            with open(importlib.util.find_spec(module).origin, "rb") as f:
+                sources.append(f.read())
+        __code_stamps__["stamp"] = joblib.hash(sources)
+    return __code_stamps__["stamp"]
+
+
+def imputer_cache_key(train_df: pd.DataFrame, missing_df: pd.DataFrame, imputer_type: str,
+                      config: dict, estimator_config: dict, scaler: dict = None) -> str:
+    # RandomStates in the configs hash by their current state, so a key also pins the draws of the fit.
+    # The sklearn version is part of the key, as fitted estimators don't carry over between versions, and
+    # so is the source of the first-party imputers. The frames are hashed as the imputer sees them, which
+    # for scaled frames leaves out their units, so the scaler that brings the output back to them is
+    # hashed too.
+    import sklearn
+    scaler_parts = None if scaler is None else [scaler["col_pos"], scaler["min"], scaler["range"]]
+    return joblib.hash([__frame_parts__(train_df), __frame_parts__(missing_df), imputer_type,
+                        config, estimator_config, sklearn.__version__, __code_stamp__(), scaler_parts])
+
+
+def __entry_path__(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, key + __CACHE_SUFFIX__)
+
+
+def __remove_entry__(path: str) -> bool:
+    # Another process may have removed the entry first
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def load_cached(cache_dir: str, key: str, configs: list[dict]) -> tuple[Any, np.ndarray]:
+    # On a hit the RandomStates of configs are moved to where fitting would have left them, so the
+    # draws after a cached run are the same as after a real one. The arrays are memory-mapped. An entry
+    # that can't be loaded, cut short or pickled by other library versions, is a miss and is removed.
+    path = __entry_path__(cache_dir, key)
+    try:
+        entry = joblib.load(path, mmap_mode="r")
+        imputer, imputed_mat, random_state_states = entry["imputer"], entry["imputed_mat"], entry["random_states"]
+    except FileNotFoundError:
+        __cache_counts__["misses"] += 1
+        return None
+    except Exception:
+        __remove_entry__(path)
+        __cache_counts__["misses"] += 1
+        return None
+
+    for random_state, state in zip(__random_states__(configs), random_state_states):
+        random_state.set_state(state)
+    # The access time is kept in the mtime, which drives the LRU eviction
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    __cache_counts__["hits"] += 1
+    return imputer, imputed_mat
+
+
+def store_cached(cache_dir: str, key: str, configs: list[dict], imputer: Any, imputed_mat: np.ndarray,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = {
+        "imputer": imputer,
+        "imputed_mat": imputed_mat,
+        "random_states": [random_state.get_state() for random_state in __random_states__(configs)]
+    }
+    # Written under a temporary name first, so readers never see a partial entry
+    tmp_path = os.path.join(cache_dir, "{}.{}.tmp".format(key, uuid.uuid4().hex))
+    joblib.dump(entry, tmp_path)
+    os.replace(tmp_path, __entry_path__(cache_dir, key))
+    evict(cache_dir, max_entries, max_bytes)
+
+
+def __cache_entries__(cache_dir: str) -> list[tuple[float, int, str]]:
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(__CACHE_SUFFIX__):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(cache_dir, name)))
+    return sorted(entries)
+
+
+def evict(cache_dir: str, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES) -> int:
+    # Drops the least recently used entries until both limits hold, returning how many were dropped
+    entries = __cache_entries__(cache_dir)
+    total_bytes = sum(size for _, size, _ in entries)
+    remaining = len(entries)
+    evicted = 0
+    for _, size, path in entries:
+        if remaining <= max_entries and total_bytes <= max_bytes:
+            break
+        # An entry another process removed first is gone all the same, but isn't counted as dropped here
+        if __remove_entry__(path):
+            evicted += 1
+        remaining -= 1
+        total_bytes -= size
+    return evicted
+
+
+def cache_stats(cache_dir: str = None) -> dict:
+    stats = dict(__cache_counts__)
+    if cache_dir is not None:
+        entries = __cache_entries__(cache_dir)
+        stats["entries"] = len(entries)
+        stats["bytes"] = sum(size for _, size, _ in entries)
+    return stats
+
+
+def reset_cache_stats() -> None:
+    for key in __cache_counts__:
+        __cache_counts__[key] = 0
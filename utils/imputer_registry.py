@@ -0,0 +1,176 @@
+import sys
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+# Imputers by name, each with the factory building it from (config, estimator_config) and its
+# capability flags. Factories import their backend on first use, so importing this module stays cheap.
+imputer_registry = dict()
+
+
+def register_imputer(name: str,
+                     factory: Callable[[dict, dict], Any],
+                     needs_scaling: bool = False,
+                     supports_categorical: bool = False,
+                     supports_warm_start: bool = False,
+                     transform_refits: bool = False) -> None:
+    # transform_refits marks imputers whose transform runs the whole fit again, over the training rows
+    # together with the rows to impute
+    imputer_registry[name] = {
+        "factory": factory,
+        "needs_scaling": needs_scaling,
+        "supports_categorical": supports_categorical,
+        "supports_warm_start": supports_warm_start,
+        "transform_refits": transform_refits
+    }
+
+
+def get_imputer_info(name: str) -> dict:
+    if name not in imputer_registry:
+        raise ValueError("imputer type must be one of {}. The value of imputer type was: {}".format(
+            list(imputer_registry.keys()), name))
+    return imputer_registry[name]
+
+
+def make_imputer(name: str, config: dict, estimator_config: dict) -> Any:
+    return get_imputer_info(name)["factory"](config, estimator_config)
+
+
+def __knn_imputer__(weights: str) -> Callable[[dict, dict], Any]:
+    def factory(config: dict, estimator_config: dict) -> Any:
+        from sklearn.impute import KNNImputer
+        return KNNImputer(weights=weights, **config)
+    return factory
+
+
+def __iterative_imputer__(make_estimator: Callable[[dict], Any]) -> Callable[[dict, dict], Any]:
+    def factory(config: dict, estimator_config: dict) -> Any:
+        from sklearn.experimental import enable_iterative_imputer
+        from sklearn.impute import IterativeImputer
+        return IterativeImputer(estimator=make_estimator(estimator_config), **config)
+    return factory
+
+
+def __linear_regression__(estimator_config: dict) -> Any:
+    from sklearn.linear_model import LinearRegression
+    return LinearRegression(**estimator_config)
+
+
+def __bayesian_ridge__(estimator_config: dict) -> Any:
+    from sklearn.linear_model import BayesianRidge
+    return BayesianRidge(**estimator_config)
+
+
+def __random_forest__(estimator_config: dict) -> Any:
+    from sklearn.ensemble import RandomForestRegressor
+    return RandomForestRegressor(**estimator_config)
+
+
+class CustomKNNImputer:
+    # fit/transform over kNN.kNN. Every missing cell of a row is predicted on its own, from the
+    # row's other observed values. attr_types defaults to every column being qualitative.
+    def __init__(self, k: int = 5, is_weighted: bool = False, attr_types: dict = None,
+                 index_type: str = "brute", batch_size: int = 64, tie_resolution: str = "incremental",
+                 metric: str = "euclidean", col_ranges: dict = None, n_threads: int = 1,
+                 index_params: dict = None):
+        self.k = k
+        self.is_weighted = is_weighted
+        self.attr_types = attr_types
+        self.index_type = index_type
+        self.batch_size = batch_size
+        self.tie_resolution = tie_resolution
+        self.metric = metric
+        self.col_ranges = col_ranges
+        self.n_threads = n_threads
+        self.index_params = index_params
+
+    def fit(self, X: Any, y: Any = None) -> "CustomKNNImputer":
+        self.train_df_ = X if isinstance(X, pd.DataFrame) else pd.DataFrame(X)
+        return self
+
+    def transform(self, X: Any) -> np.ndarray:
+        from kNN import kNN
+
+        cols = self.train_df_.columns
+        vals = np.array(X, dtype=float)
+        missing_rows, missing_col_pos = np.nonzero(np.isnan(vals))
+        if not missing_rows.size:
+            return vals
+
+        test_df = pd.DataFrame(vals[missing_rows], columns=cols)
+        missing_vals = dict(enumerate(cols[missing_col_pos]))
+        attr_types = self.attr_types if self.attr_types is not None else dict.fromkeys(cols, "qualitative")
+
+        def predict(train_df: pd.DataFrame, cell_pos: np.ndarray) -> np.ndarray:
+            predicted_df = kNN(train_df, test_df.iloc[cell_pos], missing_vals, attr_types, self.k,
+                               self.is_weighted, self.index_type, self.batch_size, self.tie_resolution,
+                               metric=self.metric, col_ranges=self.col_ranges, n_threads=self.n_threads,
+                               index_params=self.index_params)
+            return predicted_df["predictions"].to_numpy(dtype=float)
+
+        # Training rows missing the attribute to predict can't vote for it, so an attribute with such rows
+        # is predicted from the others only
+        donor_mask = self.train_df_.notna().to_numpy()
+        missing_attr_pos = np.unique(missing_col_pos)
+        if donor_mask[:, missing_attr_pos].all():
+            vals[missing_rows, missing_col_pos] = predict(self.train_df_, np.arange(missing_rows.size))
+            return vals
+        for attr_pos in missing_attr_pos:
+            cell_pos = np.flatnonzero(missing_col_pos == attr_pos)
+            vals[missing_rows[cell_pos], attr_pos] = predict(self.train_df_[donor_mask[:, attr_pos]], cell_pos)
+        return vals
+
+    def fit_transform(self, X: Any, y: Any = None) -> np.ndarray:
+        return self.fit(X).transform(X)
+
+
+def __import_missforest__() -> Any:
+    # missingpy still imports sklearn.neighbors.base, which newer sklearn versions renamed
+    import sklearn.neighbors._base
+    sys.modules.setdefault("sklearn.neighbors.base", sklearn.neighbors._base)
+    from missingpy import MissForest
+    return MissForest
+
+
+class MissForestImputer:
+    # fit/transform over missingpy's MissForest, which takes the categorical column positions in fit
+    def __init__(self, cat_vars: list = None, **params):
+        self.cat_vars = cat_vars
+        self.params = params
+
+    def fit(self, X: Any, y: Any = None) -> "MissForestImputer":
+        self.imputer_ = __import_missforest__()(**self.params).fit(np.asarray(X, dtype=float), cat_vars=self.cat_vars)
+        return self
+
+    def transform(self, X: Any) -> np.ndarray:
+        return self.imputer_.transform(np.asarray(X, dtype=float))
+
+    def fit_transform(self, X: Any, y: Any = None) -> np.ndarray:
+        return self.fit(X).transform(X)
+
+
+register_imputer("kNN", __knn_imputer__("uniform"), needs_scaling=True)
+register_imputer("WkNN", __knn_imputer__("distance"), needs_scaling=True)
+register_imputer("MICE", __iterative_imputer__(__linear_regression__), supports_warm_start=True)
+register_imputer("MICE BR", __iterative_imputer__(__bayesian_ridge__), supports_warm_start=True)
+register_imputer("MICE RF", __iterative_imputer__(__random_forest__), supports_warm_start=True)
+register_imputer("custom kNN", lambda c, estimator_config: CustomKNNImputer(**c),
+                 needs_scaling=True, supports_categorical=True)
+# Approximate neighbours for large tables, index_params in the config set the recall/speed trade-off
+register_imputer("LSH kNN", lambda c, estimator_config: CustomKNNImputer(**dict({"index_type": "lsh"}, **c)),
+                 needs_scaling=True, supports_categorical=True)
+
+
+def __miss_forest__(config: dict, estimator_config: dict) -> Any:
+    from miss_forest import MissForest
+    return MissForest(forest_params=estimator_config, **config)
+
+
+# The forests take estimator_config, as the estimator of MICE RF does
+register_imputer("MissForest", __miss_forest__, supports_categorical=True, transform_refits=True)
+# missingpy's forest options are its own, so estimator_config is merged into them, config winning on
+# keys both set
+register_imputer("missingpy MissForest",
+                 lambda c, estimator_config: MissForestImputer(**dict(estimator_config, **c)),
+                 supports_categorical=True)
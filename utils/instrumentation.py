@@ -0,0 +1,240 @@
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable
+
+import pandas as pd
+
+# Per-stage timings of the hot paths. Code marks its stages with
+#
+#   with stage("fit", rows=n):
+#       ...
+#
+# and every stage left sends a record to the sinks added with add_sink: any callable taking the record,
+# such as a MemorySink, a JsonLinesSink or a function. Without sinks, stage returns a shared object doing
+# nothing, so instrumented code costs a function call and an empty list check per stage.
+#
+# A record holds the stage name, its path under the stages open around it in the same thread ("run/fit"),
+# wall and CPU seconds, the rows given and any tags. With track_allocations, tracemalloc also gives the
+# bytes allocated and still held when the stage ends and the peak above what was held when it started;
+# tracemalloc slows every allocation down, so it is off by default, and it sees the allocations of every
+# thread at once.
+
+__sinks__ = []
+__state__ = {
+    "track_allocations": False,
+    # Whether add_sink started tracemalloc, which is then the one to stop it. Tracing started by the
+    # caller is left running.
+    "started_tracemalloc": False
+}
+__local__ = threading.local()
+
+
+def add_sink(sink: Callable[[dict], None], track_allocations: bool = False) -> Callable[[dict], None]:
+    __sinks__.append(sink)
+    if track_allocations:
+        __state__["track_allocations"] = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            __state__["started_tracemalloc"] = True
+    return sink
+
+
+def remove_sink(sink: Callable[[dict], None]) -> None:
+    __sinks__.remove(sink)
+    if not __sinks__ and __state__["track_allocations"]:
+        __state__["track_allocations"] = False
+        if __state__["started_tracemalloc"]:
+            __state__["started_tracemalloc"] = False
+            tracemalloc.stop()
+
+
+def is_enabled() -> bool:
+    return bool(__sinks__)
+
+
+class MemorySink:
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record: dict) -> None:
+        self.records.append(record)
+
+
+class JsonLinesSink:
+    # Appends a JSON object per record to path, records of several threads never interleaving
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "a")
+        self.lock = threading.Lock()
+
+    def __call__(self, record: dict) -> None:
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def __open_stages__() -> list:
+    open_stages = getattr(__local__, "stages", None)
+    if open_stages is None:
+        open_stages = __local__.stages = []
+    return open_stages
+
+
+class __Stage__:
+    __slots__ = ("name", "rows", "tags", "path", "parent", "wall_start", "cpu_start", "mem_start", "mem_peak")
+
+    def __init__(self, name: str, rows: int, tags: dict, parent: "__Stage__" = None):
+        self.name = name
+        self.rows = rows
+        self.tags = tags
+        self.parent = parent
+
+    def set_rows(self, rows: int) -> None:
+        self.rows = rows
+
+    def __enter__(self) -> "__Stage__":
+        open_stages = __open_stages__()
+        if open_stages:
+            self.parent = open_stages[-1]
+        self.path = self.name if self.parent is None else self.parent.path + "/" + self.name
+        open_stages.append(self)
+        self.mem_start = None
+        if __state__["track_allocations"] and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # The enclosing stage keeps the peak reached so far, as the peak is reset for this one
+            if self.parent is not None and self.parent.mem_start is not None:
+                self.parent.mem_peak = max(self.parent.mem_peak, peak)
+            tracemalloc.reset_peak()
+            self.mem_start, self.mem_peak = current, current
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> bool:
+        wall_seconds = time.perf_counter() - self.wall_start
+        cpu_seconds = time.process_time() - self.cpu_start
+        __open_stages__().pop()
+        record = {
+            "stage": self.name,
+            "path": self.path,
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": cpu_seconds,
+            "rows": self.rows,
+            "failed": exc_type is not None
+        }
+        if self.mem_start is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(self.mem_peak, peak)
+            if self.parent is not None and self.parent.mem_start is not None:
+                self.parent.mem_peak = max(self.parent.mem_peak, peak)
+            record["allocated_bytes"] = current - self.mem_start
+            record["peak_bytes"] = peak - self.mem_start
+        record.update(self.tags)
+        for sink in list(__sinks__):
+            sink(record)
+        return False
+
+
+class __NullStage__:
+    __slots__ = ()
+
+    def set_rows(self, rows: int) -> None:
+        pass
+
+    def __enter__(self) -> "__NullStage__":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> bool:
+        return False
+
+
+__null_stage__ = __NullStage__()
+
+
+def current_stage() -> Any:
+    # The innermost stage open in this thread, to pass as the parent of stages run on other threads
+    open_stages = getattr(__local__, "stages", None)
+    return open_stages[-1] if open_stages else None
+
+
+def stage(name: str, rows: int = None, parent: Any = None, **tags) -> Any:
+    # rows can also be set once known, with set_rows on the object the with statement gives. parent
+    # places a stage run on another thread under a stage of the thread that started it.
+    if not __sinks__:
+        return __null_stage__
+    return __Stage__(name, rows, tags, parent)
+
+
+def instrumented(name: str = None) -> Callable[[Callable], Callable]:
+    # Decorator running the whole function as a stage, named after the function by default
+    def decorator(func: Callable) -> Callable:
+        stage_name = func.__qualname__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not __sinks__:
+                return func(*args, **kwargs)
+            with __Stage__(stage_name, None, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class recording:
+    # Context manager collecting the records of its body into a MemorySink:
+    #   with recording() as sink:
+    #       run(...)
+    #   stage_summary(sink.records)
+    def __init__(self, track_allocations: bool = False):
+        self.track_allocations = track_allocations
+        self.sink = MemorySink()
+
+    def __enter__(self) -> MemorySink:
+        return add_sink(self.sink, self.track_allocations)
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> bool:
+        remove_sink(self.sink)
+        return False
+
+
+def __parent_path__(path: str) -> str:
+    return path.rpartition("/")[0]
+
+
+def stage_summary(records: list[dict]) -> pd.DataFrame:
+    # Totals per stage path. self_wall_seconds leaves out the time of the stages nested in it, which is
+    # what a flame graph shows as the stage's own width. Stages run on threads can add up to more than
+    # the wall time of their parent, rows are NaN for stages that never got any.
+    records_df = pd.DataFrame(records)
+    aggregations = {
+        "calls": ("wall_seconds", "size"),
+        "wall_seconds": ("wall_seconds", "sum"),
+        "cpu_seconds": ("cpu_seconds", "sum")
+    }
+    if "allocated_bytes" in records_df:
+        aggregations["allocated_bytes"] = ("allocated_bytes", "sum")
+        aggregations["peak_bytes"] = ("peak_bytes", "max")
+    path_groups = records_df.groupby("path", sort=False)
+    summary_df = path_groups.agg(**aggregations)
+    summary_df.insert(3, "rows", path_groups["rows"].sum(min_count=1))
+
+    children_wall = summary_df["wall_seconds"].groupby(summary_df.index.map(__parent_path__)).sum()
+    summary_df["self_wall_seconds"] = summary_df["wall_seconds"] - \
+        children_wall.reindex(summary_df.index, fill_value=0.0)
+    summary_df["rows_per_sec"] = summary_df["rows"] / summary_df["wall_seconds"]
+    return summary_df.sort_values("wall_seconds", ascending=False)
+
+
+def folded_stacks(records: list[dict]) -> list[str]:
+    # One "run;fit <microseconds>" line per path, with the self time, the input of flamegraph.pl
+    # and speedscope
+    summary_df = stage_summary(records)
+    return ["{} {}".format(path.replace("/", ";"), max(int(round(self_wall * 1e6)), 0))
+            for path, self_wall in summary_df["self_wall_seconds"].items()]
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+def __sorted_donor_weights__(sorted_dists: np.ndarray, weights: str) -> np.ndarray:
+    if weights == "uniform":
+        donor_weights = np.ones_like(sorted_dists)
+        donor_weights[np.isnan(sorted_dists)] = 0.0
+        return donor_weights
+
+    with np.errstate(divide="ignore"):
+        donor_weights = 1.0 / sorted_dists
+    # Same rule as KNNImputer: receivers at zero distance from a donor only average those donors.
+    # Donors are sorted, so a zero distance is always first and applies to every k.
+    zero_dist_rows = sorted_dists[:, 0] == 0
+    donor_weights[zero_dist_rows] = sorted_dists[zero_dist_rows] == 0
+    donor_weights[np.isnan(donor_weights)] = 0.0
+    return donor_weights
+
+
+def knn_impute_sweep(fit_X: np.ndarray, X: np.ndarray, n_neighbors_range: list,
+                     weights: str = "uniform") -> dict[int, np.ndarray]:
+    # Imputes X as a KNNImputer fitted on fit_X would for every n_neighbors in n_neighbors_range,
+    # computing the distances and the donor ordering once and each k from prefix sums.
+    from sklearn.metrics.pairwise import nan_euclidean_distances
+
+    imputed = {n_neighbors: X.copy() for n_neighbors in n_neighbors_range}
+    mask_fit_X = np.isnan(fit_X)
+    mask = np.isnan(X)
+
+    row_missing_idx = np.flatnonzero(mask.any(axis=1))
+    if row_missing_idx.size == 0:
+        return imputed
+
+    dist = nan_euclidean_distances(X[row_missing_idx], fit_X)
+    max_neighbors = max(n_neighbors_range)
+
+    for col in range(X.shape[1]):
+        receivers_pos = np.flatnonzero(mask[row_missing_idx, col])
+        if receivers_pos.size == 0:
+            continue
+
+        potential_donors_idx = np.flatnonzero(~mask_fit_X[:, col])
+        receivers_idx = row_missing_idx[receivers_pos]
+        dist_subset = dist[receivers_pos][:, potential_donors_idx]
+
+        all_nan_dist_mask = np.isnan(dist_subset).all(axis=1)
+        if all_nan_dist_mask.any():
+            col_mean = fit_X[potential_donors_idx, col].mean()
+            for imputed_X in imputed.values():
+                imputed_X[receivers_idx[all_nan_dist_mask], col] = col_mean
+            receivers_idx = receivers_idx[~all_nan_dist_mask]
+            dist_subset = dist_subset[~all_nan_dist_mask]
+            if receivers_idx.size == 0:
+                continue
+
+        donors_count = potential_donors_idx.size
+        sorted_count = min(max_neighbors, donors_count)
+        if sorted_count < donors_count:
+            donors_idx = np.argpartition(dist_subset, sorted_count - 1, axis=1)[:, :sorted_count]
+        else:
+            donors_idx = np.tile(np.arange(donors_count), (receivers_idx.size, 1))
+        donors_dist = np.take_along_axis(dist_subset, donors_idx, axis=1)
+        donors_order = np.argsort(donors_dist, axis=1, kind="stable")
+        sorted_dists = np.take_along_axis(donors_dist, donors_order, axis=1)
+        sorted_vals = fit_X[potential_donors_idx, col][np.take_along_axis(donors_idx, donors_order, axis=1)]
+
+        donor_weights = __sorted_donor_weights__(sorted_dists, weights)
+        weighted_val_sums = np.cumsum(donor_weights * sorted_vals, axis=1)
+        weight_sums = np.cumsum(donor_weights, axis=1)
+
+        for n_neighbors, imputed_X in imputed.items():
+            last = min(n_neighbors, donors_count) - 1
+            with np.errstate(invalid="ignore", divide="ignore"):
+                imputed_X[receivers_idx, col] = weighted_val_sums[:, last] / weight_sums[:, last]
+
+    return imputed
@@ -0,0 +1,43 @@
+import copy
+from typing import Any
+
+import numpy as np
+
+
+def mice_round_snapshots(imputer: Any, X: np.ndarray) -> list[np.ndarray]:
+    # Replays a fitted imputer's chained equations over X, as transform does, keeping a copy of the
+    # imputed matrix after every round: snapshots[r] is what transform gives with only r rounds.
+    mask_missing_values = np.isnan(X)
+    Xt = imputer.initial_imputer_.transform(X)
+    snapshots = [Xt.copy()]
+    if imputer.n_iter_ == 0:
+        return snapshots
+
+    n_features = X.shape[1]
+    min_value = np.broadcast_to(np.asarray(imputer.min_value, dtype=float), (n_features,))
+    max_value = np.broadcast_to(np.asarray(imputer.max_value, dtype=float), (n_features,))
+    imputations_per_round = len(imputer.imputation_sequence_) // imputer.n_iter_
+
+    for it, estimator_triplet in enumerate(imputer.imputation_sequence_):
+        feat_idx = estimator_triplet.feat_idx
+        missing_row_mask = mask_missing_values[:, feat_idx]
+        if missing_row_mask.any():
+            X_test = Xt[missing_row_mask][:, estimator_triplet.neighbor_feat_idx]
+            imputed_values = estimator_triplet.estimator.predict(X_test)
+            Xt[missing_row_mask, feat_idx] = np.clip(imputed_values, min_value[feat_idx], max_value[feat_idx])
+        if not (it + 1) % imputations_per_round:
+            snapshots.append(Xt.copy())
+
+    return snapshots
+
+
+def truncate_iterative_imputer(imputer: Any, max_iter: int) -> Any:
+    # A fitted imputer equivalent to fitting with a smaller max_iter: fitting is deterministic round by
+    # round, so the first rounds of a longer fit are exactly the rounds a shorter fit would run.
+    rounds = min(max_iter, imputer.n_iter_)
+    imputations_per_round = len(imputer.imputation_sequence_) // imputer.n_iter_ if imputer.n_iter_ else 0
+    truncated = copy.copy(imputer)
+    truncated.max_iter = max_iter
+    truncated.n_iter_ = rounds
+    truncated.imputation_sequence_ = imputer.imputation_sequence_[:rounds * imputations_per_round]
+    return truncated
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+# Logistic offsets are calibrated on at most this many scores, which keeps the bisection cheap on large frames
+__CALIBRATION_SAMPLE_SIZE__ = 10_000
+__CALIBRATION_STEPS__ = 32
+
+
+def __check_rate__(rate: float) -> None:
+    if rate < 0 or rate >= 1:
+        raise ValueError("rate must be >= 0 and < 1. The value of rate was: {}".format(rate))
+
+
+def __col_positions__(df: pd.DataFrame, cols: list = None) -> np.ndarray:
+    if cols is None:
+        return np.arange(df.shape[1])
+    col_pos = df.columns.get_indexer(cols)
+    if (col_pos < 0).any():
+        raise KeyError(list(cols)[int(np.flatnonzero(col_pos < 0)[0])])
+    return col_pos
+
+
+def __standardize__(vals: np.ndarray) -> np.ndarray:
+    nan_mask = np.isnan(vals)
+    has_nans = nan_mask.any()
+    mean = np.nanmean(vals, axis=0) if has_nans else vals.mean(axis=0)
+    std = np.nanstd(vals, axis=0) if has_nans else vals.std(axis=0)
+    std = np.where(std > 0, std, 1)
+    z_scores = (vals - mean) / std
+    if has_nans:
+        z_scores[nan_mask] = 0
+    return z_scores
+
+
+def __sigmoid__(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-x))
+
+
+def __calibrated_probas__(scores: np.ndarray, rate: float, random_generator: np.random.Generator) -> np.ndarray:
+    # Finds, per column of scores, the offset for which the mean of sigmoid(score + offset) equals rate
+    if rate == 0:
+        return np.zeros(scores.shape)
+    sample = scores if scores.shape[0] <= __CALIBRATION_SAMPLE_SIZE__ \
+        else scores[random_generator.integers(0, scores.shape[0], __CALIBRATION_SAMPLE_SIZE__)]
+    bound = np.abs(sample).max(axis=0) + 50
+    low, high = -bound, bound
+    for _ in range(__CALIBRATION_STEPS__):
+        offset = (low + high) / 2
+        below_rate = __sigmoid__(sample + offset).mean(axis=0) < rate
+        low = np.where(below_rate, offset, low)
+        high = np.where(below_rate, high, offset)
+    return __sigmoid__(scores + (low + high) / 2)
+
+
+def __keep_one_observed__(nan_mask: np.ndarray, random_generator: np.random.Generator) -> np.ndarray:
+    all_missing_rows = np.flatnonzero(nan_mask.all(axis=1))
+    if all_missing_rows.size:
+        kept_cols = random_generator.integers(0, nan_mask.shape[1], all_missing_rows.size)
+        nan_mask[all_missing_rows, kept_cols] = False
+    return nan_mask
+
+
+def mcar_mask(df: pd.DataFrame, rate: float, random_generator: np.random.Generator,
+              cols: list = None) -> np.ndarray:
+    __check_rate__(rate)
+    col_pos = __col_positions__(df, cols)
+    nan_mask = np.zeros(df.shape, dtype=bool)
+    nan_mask[:, col_pos] = random_generator.random((df.shape[0], col_pos.size)) < rate
+    return __keep_one_observed__(nan_mask, random_generator)
+
+
+def mar_mask(df: pd.DataFrame, rate: float, driver_cols: list, random_generator: np.random.Generator,
+             cols: list = None, strength: float = 1.0) -> np.ndarray:
+    # Missingness of the target cells depends on the (always observed) driver columns of the same row
+    __check_rate__(rate)
+    driver_pos = __col_positions__(df, driver_cols)
+    col_pos = np.setdiff1d(__col_positions__(df, cols), driver_pos)
+    driver_vals = df.iloc[:, driver_pos].to_numpy(dtype=float)
+    scores = strength * __standardize__(driver_vals).mean(axis=1)
+    row_probas = __calibrated_probas__(scores, rate, random_generator)
+
+    nan_mask = np.zeros(df.shape, dtype=bool)
+    nan_mask[:, col_pos] = random_generator.random((df.shape[0], col_pos.size)) < row_probas[:, np.newaxis]
+    return __keep_one_observed__(nan_mask, random_generator)
+
+
+def mnar_mask(df: pd.DataFrame, rate: float, random_generator: np.random.Generator,
+              cols: list = None, strength: float = 1.0) -> np.ndarray:
+    # Missingness of each cell depends on its own value: with strength > 0 high values go missing more often
+    __check_rate__(rate)
+    col_pos = __col_positions__(df, cols)
+    scores = strength * __standardize__(df.iloc[:, col_pos].to_numpy(dtype=float))
+    cell_probas = __calibrated_probas__(scores, rate, random_generator)
+
+    nan_mask = np.zeros(df.shape, dtype=bool)
+    nan_mask[:, col_pos] = random_generator.random(scores.shape) < cell_probas
+    return __keep_one_observed__(nan_mask, random_generator)
+
+
+def monotone_mask(df: pd.DataFrame, rate: float, random_generator: np.random.Generator,
+                  cols: list = None) -> np.ndarray:
+    # A rate share of the rows drop out at a random column of cols, missing it and every later one
+    __check_rate__(rate)
+    col_pos = __col_positions__(df, cols)
+    dropped_rows = random_generator.random(df.shape[0]) < rate
+    dropout_start = random_generator.integers(0, col_pos.size, df.shape[0])
+    dropout_mask = (np.arange(col_pos.size)[np.newaxis, :] >= dropout_start[:, np.newaxis]) & \
+        dropped_rows[:, np.newaxis]
+
+    nan_mask = np.zeros(df.shape, dtype=bool)
+    nan_mask[:, col_pos] = dropout_mask
+    return __keep_one_observed__(nan_mask, random_generator)
+
+
+def block_mask(df: pd.DataFrame, rate: float, random_generator: np.random.Generator,
+               cols: list = None, block_size: int = 10) -> np.ndarray:
+    # Consecutive blocks of block_size rows lose all of cols together, each block with probability rate
+    __check_rate__(rate)
+    if block_size < 1:
+        raise ValueError("block_size must be >= 1. The value of block_size was: {}".format(block_size))
+    col_pos = __col_positions__(df, cols)
+    block_count = -(-df.shape[0] // block_size)
+    dropped_blocks = random_generator.random(block_count) < rate
+    dropped_rows = np.repeat(dropped_blocks, block_size)[:df.shape[0]]
+
+    nan_mask = np.zeros(df.shape, dtype=bool)
+    nan_mask[np.ix_(dropped_rows, col_pos)] = True
+    return __keep_one_observed__(nan_mask, random_generator)
+
+
+def missing_from_mask(remove_vals_df: pd.DataFrame, nan_mask: np.ndarray
+                      ) -> tuple[pd.DataFrame, dict, list, list]:
+    # Rows with several missing cells are listed once per cell in missing_vals_idxs/picked_cols,
+    # so the pair can be passed to imputation.run as missing_vals_idxs/missing_col_per_pos.
+    missing_vals_df = remove_vals_df.mask(nan_mask)
+    missing_rows, missing_col_pos = np.nonzero(nan_mask)
+    missing_vals_idxs = remove_vals_df.index[missing_rows].tolist()
+    picked_cols = remove_vals_df.columns[missing_col_pos].tolist()
+
+    row_bounds = np.flatnonzero(np.diff(missing_rows)) + 1
+    row_starts = np.concatenate([[0], row_bounds]) if missing_rows.size else np.array([], dtype=np.intp)
+    row_ends = np.concatenate([row_bounds, [missing_rows.size]]) if missing_rows.size else np.array([], dtype=np.intp)
+    missing_col_map = {missing_vals_idxs[start]: picked_cols[start:end] for start, end in zip(row_starts, row_ends)}
+
+    return missing_vals_df, missing_col_map, missing_vals_idxs, picked_cols
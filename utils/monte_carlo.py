@@ -0,0 +1,220 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from utils.shared_frames import attach_frame, release_frames, share_frame
+
+# Repeats "forget values, impute them, measure the error" over independent random streams.
+#
+# forget is called as forget(remove_vals_df, random_generator=...) and returns what the forget_* functions
+# of utils.forgetter do: (missing_vals_df, missing_col_map, missing_vals_idxs, picked_cols). Bind the
+# other arguments with functools.partial, so it pickles into the pool's workers:
+#
+#   forget = functools.partial(forget_random_col_per_sample_2, weight_map=weight_map)
+#
+# Each imputer is a dict with the "imputer_type", "config" and optionally "estimator_config",
+# "disable_scaling" and "name" (the imputer type by default) of an imputation.run call.
+#
+# Repetition r draws from the r-th child of SeedSequence(seed), whatever process runs it and in whatever
+# order, so a run is reproducible from its seed, and resuming from a checkpoint gives the same results as
+# an uninterrupted run.
+
+ERROR_METRICS = ["MSE", "RMSE", "MAE"]
+
+# Per worker process state, set once by __init_repetition_worker__
+__repetition_worker_state__ = dict()
+
+
+def __imputer_name__(imputer: dict) -> str:
+    return imputer.get("name", imputer["imputer_type"])
+
+
+def __seeded_configs__(imputer: dict, seed_seq: np.random.SeedSequence) -> tuple[dict, dict]:
+    # A RandomState can't be shared by repetitions running in other processes, so each repetition gets a
+    # seed of its own in its place. Integer seeds are kept, they fix the imputer across repetitions.
+    configs = []
+    for config, config_seed_seq in zip((imputer.get("config", {}), imputer.get("estimator_config", {})),
+                                       seed_seq.spawn(2)):
+        config = dict(config)
+        if isinstance(config.get("random_state"), np.random.RandomState):
+            config["random_state"] = int(config_seed_seq.generate_state(1)[0] >> 1)
+        configs.append(config)
+    return configs[0], configs[1]
+
+
+def run_repetition(train_df: pd.DataFrame, remove_vals_df: pd.DataFrame, forget: Callable, imputers: list[dict],
+                   repetition: int, seed_seq: np.random.SeedSequence) -> list[dict]:
+    # Error rows (repetition, method, col, count, MSE, RMSE, MAE) of one repetition, for the columns that
+    # got imputed values
+    from imputation import imputed_err_stats, run
+
+    forget_seed_seq, *imputer_seed_seqs = seed_seq.spawn(1 + len(imputers))
+    missing_vals_df, _, missing_vals_idxs, picked_cols = forget(
+        remove_vals_df, random_generator=np.random.default_rng(forget_seed_seq))
+    labeled_df = pd.concat([train_df, remove_vals_df])
+    random_missing_df = pd.concat([train_df, missing_vals_df])
+
+    error_rows = []
+    for imputer, imputer_seed_seq in zip(imputers, imputer_seed_seqs):
+        config, estimator_config = __seeded_configs__(imputer, imputer_seed_seq)
+        imputed_df, _ = run(labeled_df, random_missing_df, missing_vals_idxs, picked_cols, imputer["imputer_type"],
+                            config, estimator_config, imputer.get("disable_scaling", False))
+        err_stats = imputed_err_stats(labeled_df.columns, imputed_df)
+        err_stats = err_stats[err_stats["count"] > 0]
+        for err_row in err_stats.to_dict("records"):
+            error_rows.append(dict({"repetition": repetition, "method": __imputer_name__(imputer)}, **err_row))
+    return error_rows
+
+
+def __init_repetition_worker__(train_spec: dict, remove_vals_spec: dict, forget: Callable,
+                               imputers: list[dict]) -> None:
+    train_shm, train_df = attach_frame(train_spec)
+    remove_vals_shm, remove_vals_df = attach_frame(remove_vals_spec)
+    __repetition_worker_state__.update({
+        "shms": [train_shm, remove_vals_shm],
+        "train_df": train_df,
+        "remove_vals_df": remove_vals_df,
+        "forget": forget,
+        "imputers": imputers
+    })
+
+
+def __run_repetition_in_worker__(repetition: int, seed_seq: np.random.SeedSequence) -> list[dict]:
+    state = __repetition_worker_state__
+    return run_repetition(state["train_df"], state["remove_vals_df"], state["forget"], state["imputers"],
+                          repetition, seed_seq)
+
+
+def __checkpoint_header__(seed: Any, forget: Callable, imputers: list[dict]) -> dict:
+    # The hashes cover the configs of the imputers and forget with its bound arguments, so a checkpoint
+    # isn't resumed with repetitions that were run differently
+    return {
+        "seed": repr(seed),
+        "methods": [__imputer_name__(imputer) for imputer in imputers],
+        "imputers_hash": joblib.hash(imputers),
+        "forget_hash": joblib.hash(forget)
+    }
+
+
+def load_checkpoint(checkpoint_path: str, seed: Any, forget: Callable, imputers: list[dict]) -> dict[int, list[dict]]:
+    # Error rows by repetition of a checkpoint written by run_monte_carlo. A last line cut short by an
+    # interruption is ignored, and its repetition runs again.
+    if not os.path.exists(checkpoint_path):
+        return dict()
+    with open(checkpoint_path, "r") as f:
+        lines = f.read().splitlines()
+    if not lines:
+        return dict()
+
+    header = json.loads(lines[0])
+    if header != __checkpoint_header__(seed, forget, imputers):
+        raise ValueError("checkpoint {} was written for another experiment: {}".format(checkpoint_path, header))
+    completed = dict()
+    for line in lines[1:]:
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            break
+        completed[entry["repetition"]] = entry["errors"]
+    return completed
+
+
+def __open_checkpoint__(checkpoint_path: str, seed: Any, forget: Callable, imputers: list[dict],
+                        completed: dict) -> Any:
+    # Rewrites the completed repetitions, which drops a line cut short by an interruption
+    with open(checkpoint_path + ".tmp", "w") as f:
+        f.write(json.dumps(__checkpoint_header__(seed, forget, imputers)) + "\n")
+        for repetition, error_rows in completed.items():
+            f.write(json.dumps({"repetition": repetition, "errors": error_rows}) + "\n")
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+    return open(checkpoint_path, "a")
+
+
+def summarize_errors(errors_df: pd.DataFrame, confidence: float = 0.95) -> pd.DataFrame:
+    # Mean, standard deviation and Student-t confidence interval of the mean of every error metric, per
+    # method and column, over the repetitions
+    from scipy.stats import t
+
+    if confidence <= 0 or confidence >= 1:
+        raise ValueError("confidence must be > 0 and < 1. The value of confidence was: {}".format(confidence))
+    groups = errors_df.groupby(["method", "col"], sort=False)
+    summary_df = groups.size().rename("repetitions").to_frame()
+    for metric in ERROR_METRICS:
+        mean, std = groups[metric].mean(), groups[metric].std(ddof=1)
+        half_width = t.ppf((1 + confidence) / 2, summary_df["repetitions"] - 1) * std / \
+            np.sqrt(summary_df["repetitions"])
+        summary_df["{} mean".format(metric)] = mean
+        summary_df["{} std".format(metric)] = std
+        summary_df["{} ci low".format(metric)] = mean - half_width
+        summary_df["{} ci high".format(metric)] = mean + half_width
+    return summary_df.reset_index()
+
+
+def run_monte_carlo(train_df: pd.DataFrame,
+                    remove_vals_df: pd.DataFrame,
+                    forget: Callable,
+                    imputers: list[dict],
+                    n_repetitions: int,
+                    seed: Any = None,
+                    n_jobs: int = 1,
+                    checkpoint_path: str = None,
+                    confidence: float = 0.95,
+                    verbose: bool = False) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # Runs n_repetitions repetitions of forgetting values of remove_vals_df and imputing them with every
+    # imputer, training on train_df. Returns the summary of summarize_errors and the error rows of every
+    # repetition. With checkpoint_path, each repetition is appended to it as it completes, and a later call
+    # with the same seed, forget and imputers only runs the ones missing. seed None draws fresh entropy,
+    # which can only be resumed through an explicit seed.
+    if n_repetitions < 1:
+        raise ValueError("n_repetitions must be >= 1. The value of n_repetitions was: {}".format(n_repetitions))
+    if n_jobs < 1:
+        raise ValueError("n_jobs must be >= 1. The value of n_jobs was: {}".format(n_jobs))
+    if checkpoint_path is not None and seed is None:
+        raise ValueError("checkpoints need an explicit seed to resume from")
+
+    seed_seqs = np.random.SeedSequence(seed).spawn(n_repetitions)
+    completed = dict()
+    checkpoint = None
+    if checkpoint_path is not None:
+        completed = {repetition: error_rows for repetition, error_rows
+                     in load_checkpoint(checkpoint_path, seed, forget, imputers).items() if repetition < n_repetitions}
+        checkpoint = __open_checkpoint__(checkpoint_path, seed, forget, imputers, completed)
+    pending = [repetition for repetition in range(n_repetitions) if repetition not in completed]
+
+    def complete(repetition: int, error_rows: list[dict]) -> None:
+        completed[repetition] = error_rows
+        if checkpoint is not None:
+            checkpoint.write(json.dumps({"repetition": repetition, "errors": error_rows}) + "\n")
+            checkpoint.flush()
+        if verbose:
+            print("Repetition {} done, {}/{}".format(repetition, len(completed), n_repetitions), flush=True)
+
+    try:
+        if n_jobs == 1 or len(pending) <= 1:
+            for repetition in pending:
+                complete(repetition, run_repetition(train_df, remove_vals_df, forget, imputers, repetition,
+                                                    seed_seqs[repetition]))
+        else:
+            # The frames travel through shared memory, once per worker instead of once per repetition
+            train_shm, train_spec = share_frame(train_df)
+            remove_vals_shm, remove_vals_spec = share_frame(remove_vals_df)
+            try:
+                with ProcessPoolExecutor(max_workers=n_jobs, initializer=__init_repetition_worker__,
+                                         initargs=(train_spec, remove_vals_spec, forget, imputers)) as executor:
+                    futures = {executor.submit(__run_repetition_in_worker__, repetition,
+                                               seed_seqs[repetition]): repetition for repetition in pending}
+                    for future in as_completed(futures):
+                        complete(futures[future], future.result())
+            finally:
+                release_frames([train_shm, remove_vals_shm])
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+    errors_df = pd.DataFrame([error_row for repetition in sorted(completed) for error_row in completed[repetition]])
+    return summarize_errors(errors_df, confidence), errors_df
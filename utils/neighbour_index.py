@@ -0,0 +1,274 @@
+from typing import Callable
+
+import numpy as np
+from sklearn.neighbors import BallTree, KDTree
+
+NeighbourQuery = Callable[[np.ndarray, int], tuple[np.ndarray, np.ndarray]]
+
+DEFAULT_BLOCK_SIZE = 1024
+# Upper bound on the queries x points x features elements broadcast at once by blocked_distances
+__BLOCK_ELEMENTS__ = 1 << 16
+
+# Relative slack used to widen the tree radius so that points whose exact distance ties with
+# the k-th neighbour are never left out by rounding differences in the tree's own metric.
+__TREE_RADIUS_SLACK__ = 1e-9
+
+
+def pairwise_distances(queries: np.ndarray, points: np.ndarray) -> np.ndarray:
+    # The differences are written into a C ordered array whatever the order of the inputs, so the sum of
+    # every pair runs over a contiguous row, adding in the order np.sum of that pair's row alone does. A
+    # layout following the inputs can sum the features in another order, and round differently.
+    sqr_diffs = np.empty((queries.shape[0], points.shape[0], queries.shape[1]))
+    np.subtract(queries[:, np.newaxis, :], points[np.newaxis, :, :], out=sqr_diffs)
+    sqr_diffs **= 2
+    # NaN dimensions are skipped, same as the pandas sum the row-wise implementation relies on
+    sqr_diffs[np.isnan(sqr_diffs)] = 0
+    return np.sqrt(sqr_diffs.sum(axis=2))
+
+
+def blocked_distances(queries: np.ndarray, points: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE
+                      ) -> np.ndarray:
+    # Large query batches get smaller point blocks, so the broadcast differences stay cache sized
+    block_size = max(1, min(block_size, __BLOCK_ELEMENTS__ // max(queries.shape[0] * queries.shape[1], 1)))
+    distances = np.empty((queries.shape[0], points.shape[0]))
+    for start in range(0, points.shape[0], block_size):
+        end = start + block_size
+        distances[:, start:end] = pairwise_distances(queries, points[start:end])
+    return distances
+
+
+def smallest_k(distances: np.ndarray, k: int) -> np.ndarray:
+    # Stable top-k: ties are broken by position, the same order a stable full sort would give
+    if k >= distances.shape[0]:
+        return np.argsort(distances, kind="stable")
+    kth_distance = distances[np.argpartition(distances, k - 1)[k - 1]]
+    candidates = np.flatnonzero(distances <= kth_distance)
+    candidates_order = np.argsort(distances[candidates], kind="stable")
+    return candidates[candidates_order[:k]]
+
+
+def __select_k_smallest__(distances: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    k = min(k, distances.shape[1])
+    neighbour_pos = np.empty((distances.shape[0], k), dtype=np.intp)
+    for i in range(distances.shape[0]):
+        neighbour_pos[i] = smallest_k(distances[i], k)
+    return neighbour_pos, np.take_along_axis(distances, neighbour_pos, axis=1)
+
+
+def __brute_index__(points: np.ndarray, block_size: int) -> NeighbourQuery:
+    def query(queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        distances = blocked_distances(queries, points, block_size)
+        return __select_k_smallest__(distances, k)
+
+    return query
+
+
+def __tree_index__(tree_type: type) -> Callable[[np.ndarray, int], NeighbourQuery]:
+    def build(points: np.ndarray, block_size: int) -> NeighbourQuery:
+        if np.isnan(points).any():
+            raise ValueError("{} index does not support NaN values in the indexed points".format(tree_type.__name__))
+        tree = tree_type(points)
+        brute_query = __brute_index__(points, block_size)
+
+        def query(queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+            k = min(k, points.shape[0])
+            neighbour_pos = np.empty((queries.shape[0], k), dtype=np.intp)
+            neighbour_dists = np.empty((queries.shape[0], k))
+            for i in range(queries.shape[0]):
+                query_row = queries[i:i + 1]
+                if np.isnan(query_row).any():
+                    neighbour_pos[i], neighbour_dists[i] = [v[0] for v in brute_query(query_row, k)]
+                    continue
+                tree_dists, _ = tree.query(query_row, k=k)
+                radius = tree_dists[0, -1] * (1 + __TREE_RADIUS_SLACK__) + __TREE_RADIUS_SLACK__
+                candidates = np.sort(tree.query_radius(query_row, r=radius)[0])
+                candidate_dists = pairwise_distances(query_row, points[candidates])[0]
+                selected = smallest_k(candidate_dists, k)
+                neighbour_pos[i] = candidates[selected]
+                neighbour_dists[i] = candidate_dists[selected]
+            return neighbour_pos, neighbour_dists
+
+        return query
+
+    return build
+
+
+def __category_one_hot__(vals: np.ndarray, categories: list[np.ndarray]) -> np.ndarray:
+    # Values no indexed point has, like missing ones, get an all zero row and so never match
+    one_hot = np.zeros((vals.shape[0], sum(col_categories.size for col_categories in categories)))
+    offset = 0
+    for j, col_categories in enumerate(categories):
+        if col_categories.size:
+            col_vals = vals[:, j]
+            pos = np.minimum(np.searchsorted(col_categories, col_vals), col_categories.size - 1)
+            found = np.flatnonzero(col_categories[pos] == col_vals)
+            one_hot[found, offset + pos[found]] = 1
+        offset += col_categories.size
+    return one_hot
+
+
+def __encode_mixed__(vals: np.ndarray, is_categorical: np.ndarray, col_ranges: np.ndarray,
+                     categories: list[np.ndarray]) -> dict:
+    num = vals[:, ~is_categorical] / col_ranges
+    cat = vals[:, is_categorical]
+    return {
+        "num": num,
+        "num_observed": (~np.isnan(num)).astype(float),
+        "has_nan": bool(np.isnan(num).any()),
+        "one_hot": __category_one_hot__(cat, categories),
+        "cat_observed": (~np.isnan(cat)).astype(float)
+    }
+
+
+def mixed_distances(query_enc: dict, point_enc: dict, metric: str) -> np.ndarray:
+    # Numeric values come divided by their column range, categorical ones one hot encoded. Dimensions
+    # missing in either row are skipped and the rest re-weighted to all dimensions, as nan_euclidean
+    # does. Pairs without a common observed dimension are infinitely far apart. Counts of observed
+    # dimensions and of categorical matches are products of 0/1 matrices, so they are exact.
+    cat_observed_count = query_enc["cat_observed"] @ point_enc["cat_observed"].T
+    cat_diff_count = cat_observed_count - query_enc["one_hot"] @ point_enc["one_hot"].T
+    observed_count = query_enc["num_observed"] @ point_enc["num_observed"].T + cat_observed_count
+
+    num_diffs = np.abs(query_enc["num"][:, np.newaxis, :] - point_enc["num"][np.newaxis, :, :])
+    if query_enc["has_nan"] or point_enc["has_nan"]:
+        num_diffs[np.isnan(num_diffs)] = 0
+
+    dims_count = query_enc["num"].shape[1] + query_enc["cat_observed"].shape[1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if metric == "gower":
+            distances = (num_diffs.sum(axis=2) + cat_diff_count) / observed_count
+        else:
+            distances = np.sqrt(((num_diffs ** 2).sum(axis=2) + cat_diff_count) * dims_count / observed_count)
+    distances[observed_count == 0] = np.inf
+    return distances
+
+
+mixed_metrics = ("heom", "gower")
+
+
+def build_mixed_index(points: np.ndarray, is_categorical: np.ndarray, col_ranges: np.ndarray,
+                      metric: str = "heom", block_size: int = DEFAULT_BLOCK_SIZE) -> NeighbourQuery:
+    # Brute force HEOM/Gower neighbours: categorical columns add 0 on a match and 1 otherwise,
+    # numeric ones their difference over col_ranges
+    if metric not in mixed_metrics:
+        raise ValueError("metric must be one of {}. The value was: {}".format(mixed_metrics, metric))
+    points = np.asarray(points, dtype=float)
+    is_categorical = np.asarray(is_categorical, dtype=bool)
+    col_ranges = np.asarray(col_ranges, dtype=float)[~is_categorical]
+    col_ranges = np.where(col_ranges > 0, col_ranges, 1)
+
+    categories = [np.unique(col[~np.isnan(col)]) for col in points[:, is_categorical].T]
+    point_blocks = []
+    for start in range(0, points.shape[0], block_size):
+        point_blocks.append((start, __encode_mixed__(points[start:start + block_size], is_categorical, col_ranges,
+                                                     categories)))
+
+    # Queries are taken in chunks, so the broadcast numeric differences stay cache sized
+    query_chunk_size = max(1, __BLOCK_ELEMENTS__ // (block_size * max(int((~is_categorical).sum()), 1)))
+
+    def query(queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=float)
+        distances = np.empty((queries.shape[0], points.shape[0]))
+        for query_start in range(0, queries.shape[0], query_chunk_size):
+            query_end = query_start + query_chunk_size
+            query_enc = __encode_mixed__(queries[query_start:query_end], is_categorical, col_ranges, categories)
+            for start, point_enc in point_blocks:
+                distances[query_start:query_end, start:start + block_size] = mixed_distances(query_enc, point_enc,
+                                                                                              metric)
+        return __select_k_smallest__(distances, k)
+
+    return query
+
+
+def __lsh_index__(points: np.ndarray, block_size: int, n_tables: int = 8, n_bits: int = 6,
+                  bucket_width: float = 1.0, random_state: int = 0) -> NeighbourQuery:
+    # Random projection (p-stable) LSH: every table hashes a point by cutting n_bits projections on
+    # gaussian directions into buckets of bucket_width standard deviations of the projected points.
+    # The points sharing a bucket with the query in any table are ranked by exact distance. More
+    # tables or wider buckets raise recall, more bits make buckets smaller and queries faster.
+    # Queries with fewer than k candidates fall back to the exact brute force search.
+    if n_tables < 1 or n_bits < 1:
+        raise ValueError("n_tables and n_bits must be >= 1. The values were: {}, {}".format(n_tables, n_bits))
+    if bucket_width <= 0:
+        raise ValueError("bucket_width must be > 0. The value of bucket_width was: {}".format(bucket_width))
+    random_generator = np.random.default_rng(random_state)
+    brute_query = __brute_index__(points, block_size)
+
+    # NaNs only matter for hashing here (the ranking skips them), so they hash as the column mean
+    col_means = np.zeros(points.shape[1])
+    observed_cols = ~np.isnan(points).all(axis=0)
+    col_means[observed_cols] = np.nanmean(points[:, observed_cols], axis=0)
+    key_multipliers = random_generator.integers(1, np.iinfo(np.int64).max, n_bits) | 1
+
+    def fill_nans(vals: np.ndarray) -> np.ndarray:
+        return np.where(np.isnan(vals), col_means, vals)
+
+    def bucket_keys(vals: np.ndarray, table: dict) -> np.ndarray:
+        codes = np.floor((vals @ table["directions"] + table["offsets"]) / table["widths"]).astype(np.int64)
+        # Bucket codes are folded into one integer key, a rare collision only merges two buckets
+        return (codes * key_multipliers).sum(axis=1)
+
+    filled_points = fill_nans(points)
+    tables = []
+    for _ in range(n_tables):
+        directions = random_generator.standard_normal((points.shape[1], n_bits))
+        projections = filled_points @ directions
+        widths = bucket_width * projections.std(axis=0) if points.shape[0] else np.ones(n_bits)
+        widths = np.where(widths > 0, widths, 1)
+        table = {
+            "directions": directions,
+            "widths": widths,
+            "offsets": random_generator.uniform(0, 1, n_bits) * widths
+        }
+        keys = bucket_keys(filled_points, table)
+        table["order"] = np.argsort(keys, kind="stable")
+        table["sorted_keys"] = keys[table["order"]]
+        tables.append(table)
+
+    def query(queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        k = min(k, points.shape[0])
+        filled_queries = fill_nans(queries)
+        bucket_bounds = []
+        for table in tables:
+            keys = bucket_keys(filled_queries, table)
+            bucket_bounds.append((np.searchsorted(table["sorted_keys"], keys, side="left"),
+                                  np.searchsorted(table["sorted_keys"], keys, side="right")))
+
+        neighbour_pos = np.empty((queries.shape[0], k), dtype=np.intp)
+        neighbour_dists = np.empty((queries.shape[0], k))
+        exact_rows = []
+        for i in range(queries.shape[0]):
+            candidates = np.unique(np.concatenate([table["order"][starts[i]:ends[i]]
+                                                   for table, (starts, ends) in zip(tables, bucket_bounds)]))
+            if candidates.size < k:
+                exact_rows.append(i)
+                continue
+            # Candidates are in position order, so ties are broken as the exact engine breaks them
+            candidate_dists = pairwise_distances(queries[i:i + 1], points[candidates])[0]
+            selected = smallest_k(candidate_dists, k)
+            neighbour_pos[i] = candidates[selected]
+            neighbour_dists[i] = candidate_dists[selected]
+
+        if exact_rows:
+            neighbour_pos[exact_rows], neighbour_dists[exact_rows] = brute_query(queries[exact_rows], k)
+        return neighbour_pos, neighbour_dists
+
+    return query
+
+
+neighbour_index_type_map = {
+    "brute": __brute_index__,
+    "kd_tree": __tree_index__(KDTree),
+    "ball_tree": __tree_index__(BallTree),
+    "lsh": __lsh_index__,
+}
+
+
+def build_neighbour_index(points: np.ndarray, index_type: str = "brute",
+                          block_size: int = DEFAULT_BLOCK_SIZE, index_params: dict = None) -> NeighbourQuery:
+    # index_params are the index type's own options, e.g. n_tables/n_bits/bucket_width for "lsh"
+    if index_type not in neighbour_index_type_map:
+        raise ValueError("index type must be one of {}. The value was: {}".format(
+            list(neighbour_index_type_map.keys()), index_type))
+    points = np.ascontiguousarray(points, dtype=float)
+    return neighbour_index_type_map[index_type](points, block_size, **(index_params or {}))
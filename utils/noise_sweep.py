@@ -0,0 +1,105 @@
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from utils.noise_utils import column_sigmas, noise_tensor
+from utils.scaling import scale_values
+
+# Imputation error against the noise in the data, as noise_cmp.ipynb measures it, for every noise level,
+# column and imputer in one table.
+#
+# The values are forgotten once, with forget called as in utils.monte_carlo, so every level imputes the
+# same cells. The noise of all levels comes from one noise_tensor call. noisy_part picks where it goes:
+#   "train": the training rows, as in noise_cmp.ipynb. The imputers learn from noisy data, so each level
+#            needs its own scaler and fit; the rows, missing cells and real values are gathered once.
+#   "test": the observed cells of the rows to impute. Each imputer, with its scaler and whatever it built
+#           in fit (neighbour data, trained estimators), is fitted once and reused by every level.
+
+noisy_parts = ("train", "test")
+
+
+def __level_vals__(vals: np.ndarray, col_pos: np.ndarray, noisy_vals: np.ndarray) -> np.ndarray:
+    vals = vals.copy()
+    vals[:, col_pos] = noisy_vals
+    return vals
+
+
+def __error_rows__(err_stats: pd.DataFrame, noise_level: float, method: str) -> pd.DataFrame:
+    err_stats = err_stats[err_stats["count"] > 0]
+    err_stats.insert(0, "noise_level", noise_level)
+    err_stats.insert(1, "method", method)
+    return err_stats
+
+
+def run_noise_sweep(train_df: pd.DataFrame,
+                    remove_vals_df: pd.DataFrame,
+                    forget: Callable,
+                    imputers: list[dict],
+                    noise_levels: list,
+                    noise_cols: list = None,
+                    noise_kind: str = "gaussian",
+                    noisy_part: str = "train",
+                    seed: Any = None) -> pd.DataFrame:
+    # Imputers are given as in utils.monte_carlo. Returns the error rows (noise_level, method, col, count,
+    # MSE, RMSE, MAE) of the imputed columns. noise_cols defaults to every column, and the noise is sized
+    # by the standard deviation of each column over train_df.
+    from imputation import evaluate_imputation_stats, prepare_imputation, scale_imputation
+    from utils.imputer_registry import get_imputer_info, make_imputer
+
+    if noisy_part not in noisy_parts:
+        raise ValueError("noisy part must be one of {}. The value of noisy part was: {}".format(noisy_parts,
+                                                                                             noisy_part))
+    if noise_cols is None:
+        noise_cols = list(train_df.columns)
+    forget_seed_seq, noise_seed_seq = np.random.SeedSequence(seed).spawn(2)
+
+    missing_vals_df, _, missing_vals_idxs, picked_cols = forget(
+        remove_vals_df, random_generator=np.random.default_rng(forget_seed_seq))
+    imputation_data = prepare_imputation(pd.concat([train_df, remove_vals_df]),
+                                         pd.concat([train_df, missing_vals_df]), missing_vals_idxs, picked_cols)
+
+    noisy_key = "train_df" if noisy_part == "train" else "missing_df"
+    noisy_df = imputation_data[noisy_key]
+    noisy_vals = noisy_df.to_numpy(dtype=float)
+    col_pos = noisy_df.columns.get_indexer(noise_cols)
+    if (col_pos < 0).any():
+        raise KeyError(list(noise_cols)[int(np.flatnonzero(col_pos < 0)[0])])
+    noisy_levels = noise_tensor(noisy_vals[:, col_pos], noise_levels, column_sigmas(train_df, noise_cols),
+                                noise_kind, np.random.default_rng(noise_seed_seq))
+
+    error_dfs = []
+    for imputer_spec in imputers:
+        imputer_type = imputer_spec["imputer_type"]
+        method = imputer_spec.get("name", imputer_type)
+        scale = get_imputer_info(imputer_type)["needs_scaling"] and not imputer_spec.get("disable_scaling", False)
+
+        def fit_imputer(fit_data: dict) -> Any:
+            imputer = make_imputer(imputer_type, dict(imputer_spec.get("config", {})),
+                                   dict(imputer_spec.get("estimator_config", {})))
+            return imputer.fit(fit_data["train_df"])
+
+        if noisy_part == "train":
+            for level_pos, noise_level in enumerate(noise_levels):
+                level_train_df = pd.DataFrame(__level_vals__(noisy_vals, col_pos, noisy_levels[level_pos]),
+                                              index=noisy_df.index, columns=noisy_df.columns, copy=False)
+                level_data = dict(imputation_data, train_df=level_train_df)
+                if scale:
+                    level_data = scale_imputation(level_data)
+                imputed_mat = fit_imputer(level_data).transform(level_data["missing_df"])
+                error_dfs.append(__error_rows__(evaluate_imputation_stats(imputed_mat, level_data), noise_level,
+                                                method))
+            continue
+
+        fit_data = scale_imputation(imputation_data) if scale else imputation_data
+        imputer = fit_imputer(fit_data)
+        for level_pos, noise_level in enumerate(noise_levels):
+            level_missing_vals = __level_vals__(noisy_vals, col_pos, noisy_levels[level_pos])
+            if scale:
+                # Scaled with the training scaler, as the imputer was fitted on it
+                scale_values(level_missing_vals, fit_data["scaler"])
+            imputed_mat = imputer.transform(pd.DataFrame(level_missing_vals, index=noisy_df.index,
+                                                         columns=noisy_df.columns, copy=False))
+            error_dfs.append(__error_rows__(evaluate_imputation_stats(imputed_mat, fit_data), noise_level, method))
+
+    return pd.concat(error_dfs, ignore_index=True)
@@ -1,3 +1,5 @@
+from typing import Any
+
 import numpy as np
 import pandas as pd
 
@@ -13,3 +15,36 @@ def add_noise_to_column(df: pd.DataFrame, column_name: str, scale_factor: float
     std_deviation = df[column_name].std() * scale_factor
 
     return add_noise(df[column_name], sigma=std_deviation)
+
+
+noise_kinds = ("gaussian", "multiplicative", "quantisation")
+
+
+def column_sigmas(df: pd.DataFrame, cols: list = None) -> np.ndarray:
+    # Standard deviation of every column in one pass, as add_noise_to_column takes it
+    return (df if cols is None else df[cols]).std().to_numpy(dtype=float)
+
+
+def noise_tensor(vals: np.ndarray, noise_levels: Any, sigmas: np.ndarray, noise_kind: str = "gaussian",
+                 random_generator: np.random.Generator = None) -> np.ndarray:
+    # vals at every noise level at once, shaped (levels, rows, columns):
+    #   gaussian: vals + N(0, level * sigma), the noise of add_noise_to_column with level as scale_factor
+    #   multiplicative: vals * (1 + N(0, level))
+    #   quantisation: vals rounded to a grid of step level * sigma
+    # The random levels share one standard normal draw, scaled per level, so levels differ in the noise
+    # size only. NaN stays NaN.
+    if noise_kind not in noise_kinds:
+        raise ValueError("noise kind must be one of {}. The value of noise kind was: {}".format(noise_kinds,
+                                                                                             noise_kind))
+    noise_levels = np.asarray(noise_levels, dtype=float)[:, np.newaxis, np.newaxis]
+    if noise_kind == "quantisation":
+        steps = noise_levels * sigmas
+        safe_steps = np.where(steps > 0, steps, 1)
+        return np.where(steps > 0, np.round(vals / safe_steps) * safe_steps, vals)
+
+    if random_generator is None:
+        random_generator = np.random.default_rng()
+    standard_noise = random_generator.standard_normal(vals.shape)
+    if noise_kind == "gaussian":
+        return vals + noise_levels * sigmas * standard_noise
+    return vals * (1 + noise_levels * standard_noise)
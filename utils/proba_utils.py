@@ -51,6 +51,11 @@ def cum_sum_intervals_from_weights(weight_map: dict[Any, int]
     return cum_sum_intervals_from_proba_map(proba_map)
 
 
+def cum_sum_bounds_from_intervals(cum_sum_intervals: list[pd.Interval]) -> np.ndarray:
+    # The intervals are contiguous, so each one is identified by its right bound alone
+    return np.array([interval.right for interval in cum_sum_intervals], dtype=float)
+
+
 def get_interval_col(picked_val: float, cum_sum_intervals: list[pd.Interval],
                      cum_sum_col_map: dict[int, Any]) -> Any:
     interval_count = len(cum_sum_intervals)
@@ -63,25 +68,39 @@ def get_interval_col(picked_val: float, cum_sum_intervals: list[pd.Interval],
             return picked_col
 
 
+def sample_col_idxs(picked_size: int, cum_sum_bounds: np.ndarray,
+                    random_generator: np.random.Generator) -> np.ndarray:
+    picked = random_generator.random(picked_size)
+    # side="right" matches the left-closed intervals: a value on a bound belongs to the next interval
+    picked_idxs = np.searchsorted(cum_sum_bounds, picked, side="right")
+    return np.minimum(picked_idxs, cum_sum_bounds.shape[0] - 1)
+
+
 def sample_cols(picked_size: int, cum_sum_intervals: list[pd.Interval],
                 cum_sum_col_map: dict[int, Any],
                 random_generator: np.random.Generator) -> list[Any]:
-    picked = random_generator.random(picked_size)
-    picked_cols = [get_interval_col(sample, cum_sum_intervals, cum_sum_col_map) for sample in picked]
-    return picked_cols
+    cum_sum_bounds = cum_sum_bounds_from_intervals(cum_sum_intervals)
+    picked_idxs = sample_col_idxs(picked_size, cum_sum_bounds, random_generator)
+    cols = np.empty(len(cum_sum_col_map), dtype=object)
+    cols[:] = [cum_sum_col_map[i] for i in range(len(cum_sum_col_map))]
+    return cols[picked_idxs].tolist()
 
 
-def create_nan_vals(remove_vals_df: pd.DataFrame, picked_cols: list
-                    ) -> tuple[pd.DataFrame, dict]:
-    missing_vals_df = remove_vals_df.copy()
-    missing_col_map = dict()
-    i = 0
-    for idx in missing_vals_df.index:
-        missing_col = picked_cols[i]
-        missing_col_map[idx] = missing_col
+def nan_mask_from_cols(remove_vals_df: pd.DataFrame, picked_cols: list) -> np.ndarray:
+    picked_codes, picked_uniques = pd.factorize(np.asarray(picked_cols, dtype=object))
+    unique_col_pos = remove_vals_df.columns.get_indexer(picked_uniques)
+    if (unique_col_pos < 0).any():
+        raise KeyError(picked_uniques[int(np.flatnonzero(unique_col_pos < 0)[0])])
+    picked_col_pos = unique_col_pos[picked_codes]
+    nan_mask = np.zeros(remove_vals_df.shape, dtype=bool)
+    nan_mask[np.arange(remove_vals_df.shape[0]), picked_col_pos] = True
+    return nan_mask
 
-        missing_vals_df.loc[idx][missing_col] = np.NaN
 
-        i += 1
+def create_nan_vals(remove_vals_df: pd.DataFrame, picked_cols: list
+                    ) -> tuple[pd.DataFrame, dict]:
+    picked_cols = list(picked_cols)[:remove_vals_df.shape[0]]
+    missing_vals_df = remove_vals_df.mask(nan_mask_from_cols(remove_vals_df, picked_cols))
+    missing_col_map = dict(zip(remove_vals_df.index, picked_cols))
 
     return missing_vals_df, missing_col_map
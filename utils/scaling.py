@@ -0,0 +1,46 @@
+import numpy as np
+
+
+def fit_scaler(values: np.ndarray, col_pos: np.ndarray) -> dict:
+    # Min/range of the columns at col_pos over their observed (non NaN) cells only. The other columns
+    # get the identity (min 0, range 1), so the arrays can be indexed by any column position.
+    col_pos = np.asarray(col_pos, dtype=np.intp)
+    col_min = np.zeros(values.shape[1])
+    col_range = np.ones(values.shape[1])
+    if col_pos.size:
+        observed = values[:, col_pos]
+        # fmin/fmax skip NaNs and leave all-NaN columns NaN, without nanmin's warning
+        observed_min = np.fmin.reduce(observed, axis=0, initial=np.nan)
+        observed_max = np.fmax.reduce(observed, axis=0, initial=np.nan)
+        observed_range = observed_max - observed_min
+        # Constant or unobserved columns are only shifted, instead of divided by zero
+        col_min[col_pos] = np.where(np.isnan(observed_min), 0, observed_min)
+        col_range[col_pos] = np.where(np.isnan(observed_range) | (observed_range == 0), 1, observed_range)
+    return {
+        "col_pos": col_pos,
+        "min": col_min,
+        "range": col_range
+    }
+
+
+def scale_values(values: np.ndarray, scaler: dict, out: np.ndarray = None) -> np.ndarray:
+    # Scales values in place, or into out if given, touching the scaled columns only
+    if out is not None:
+        np.copyto(out, values)
+        values = out
+    for pos in scaler["col_pos"]:
+        col = values[:, pos]
+        col -= scaler["min"][pos]
+        col /= scaler["range"][pos]
+    return values
+
+
+def unscale_values(values: np.ndarray, scaler: dict, out: np.ndarray = None) -> np.ndarray:
+    if out is not None:
+        np.copyto(out, values)
+        values = out
+    for pos in scaler["col_pos"]:
+        col = values[:, pos]
+        col *= scaler["range"][pos]
+        col += scaler["min"][pos]
+    return values
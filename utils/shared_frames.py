@@ -0,0 +1,31 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+
+def share_frame(df: pd.DataFrame) -> tuple[SharedMemory, dict]:
+    values = df.to_numpy(dtype=float)
+    shm = SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=float, buffer=shm.buf)[:] = values
+    frame_spec = {
+        "name": shm.name,
+        "shape": values.shape,
+        "index": df.index,
+        "columns": df.columns
+    }
+    return shm, frame_spec
+
+
+def attach_frame(frame_spec: dict) -> tuple[SharedMemory, pd.DataFrame]:
+    # The returned SharedMemory must outlive the frame, which is a view over its buffer
+    shm = SharedMemory(name=frame_spec["name"])
+    values = np.ndarray(frame_spec["shape"], dtype=float, buffer=shm.buf)
+    df = pd.DataFrame(values, index=frame_spec["index"], columns=frame_spec["columns"], copy=False)
+    return shm, df
+
+
+def release_frames(shms: list[SharedMemory]) -> None:
+    for shm in shms:
+        shm.close()
+        shm.unlink()
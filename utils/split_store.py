@@ -0,0 +1,146 @@
+import json
+import os
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import load_thyroid
+from utils.data_split import k_fold_draw, k_fold_split_idxs_from_draw
+
+# The k-fold splits of the rows data_processing.ipynb prepares, kept as the draws that make them instead
+# of as a train and test CSV per k. For every k the store holds the shuffled positions, dealt round-robin
+# into the k folds as utils.data_split does (fold i is shuffled_positions[i::k]), and the folds drawn as
+# test folds, both over the rows of one base frame. A (train, test) pair is gathered from the base frame
+# with take, so the data is parsed once whatever the number of splits.
+#
+# The store is a single .npz file (data/splits.npz), with the seed, the index labels of the base rows and
+# the arrays of every k in the smallest integer dtype that holds them. Splits added for a new k draw from
+# default_rng([seed, k]), so they don't depend on the other ks of the store.
+
+SPLIT_STORE_FILENAME = "splits.npz"
+
+# The ks and seed data_processing.ipynb wrote the {k}-train_df.csv/{k}-test_df.csv files with. It drew a k=5
+# split before them from the same generator.
+LEGACY_KS = [2, 3, 4, 5, 10, 100, 500, 1000]
+LEGACY_SEED = 42
+__LEGACY_DISCARDED_K__ = 5
+
+__SEX_CODES__ = {
+    "F": 0,
+    "M": 1
+}
+
+
+def __read_json__(path: str) -> Any:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def base_frame(data_dir: str = "data", float_dtype: Any = np.float64) -> pd.DataFrame:
+    # The rows and columns of thyroidDF.csv that data_processing.ipynb splits: qualitative and categorical
+    # columns, ages in [0, 100), no missing values, t/f and F/M encoded as 0/1
+    qualitative_cols = __read_json__(os.path.join(data_dir, "qualitative_cols.json"))
+    categorical_cols = __read_json__(os.path.join(data_dir, "categorical_cols.json"))
+    thyroid_df = load_thyroid(data_dir)
+    thyroid_df = thyroid_df[(thyroid_df["age"] >= 0) & (thyroid_df["age"] < 100)]
+    df = thyroid_df[qualitative_cols + categorical_cols].dropna()
+    cols = dict()
+    for col in df.columns:
+        vals = df[col].map(__SEX_CODES__) if col == "sex" else df[col]
+        cols[col] = vals.to_numpy(dtype=float_dtype)
+    return pd.DataFrame(cols, index=df.index)
+
+
+def __compact__(vals: np.ndarray, max_val: int) -> np.ndarray:
+    return vals.astype(np.min_scalar_type(max_val))
+
+
+def __draw_splits__(store: dict, k: int, n: int, random_state: np.random.Generator) -> None:
+    size = store["index"].shape[0]
+    shuffled_positions, test_folds = k_fold_draw(size, k, n, random_state)
+    store["splits"][k] = {
+        "shuffled_positions": __compact__(shuffled_positions, size - 1),
+        "test_folds": __compact__(test_folds, k - 1)
+    }
+
+
+def new_split_store(index: pd.Index, seed: int) -> dict:
+    return {
+        "seed": seed,
+        "index": np.asarray(index),
+        "splits": dict()
+    }
+
+
+def add_splits(store: dict, ks: list[int], n: int = 1, replace: bool = False) -> dict:
+    for k in ks:
+        if k in store["splits"] and not replace:
+            raise ValueError("the store already has splits for k = {}".format(k))
+        __draw_splits__(store, k, n, np.random.default_rng([store["seed"], k]))
+    return store
+
+
+def legacy_split_store(index: pd.Index) -> dict:
+    # The splits of the {k}-train_df.csv/{k}-test_df.csv files, drawn again as data_processing.ipynb did,
+    # from one generator in the order of the notebook
+    store = new_split_store(index, LEGACY_SEED)
+    random_state = np.random.default_rng(LEGACY_SEED)
+    k_fold_draw(len(index), __LEGACY_DISCARDED_K__, 1, random_state)
+    for k in LEGACY_KS:
+        __draw_splits__(store, k, 1, random_state)
+    return store
+
+
+def save_split_store(store: dict, path: str) -> None:
+    arrays = {
+        "seed": np.array(store["seed"]),
+        "index": store["index"],
+        "ks": np.array(sorted(store["splits"]), dtype=np.int64)
+    }
+    for k, splits in store["splits"].items():
+        arrays["shuffled_positions_{}".format(k)] = splits["shuffled_positions"]
+        arrays["test_folds_{}".format(k)] = splits["test_folds"]
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_split_store(path: str) -> dict:
+    with np.load(path) as arrays:
+        store = new_split_store(arrays["index"], int(arrays["seed"]))
+        for k in arrays["ks"].tolist():
+            store["splits"][k] = {
+                "shuffled_positions": arrays["shuffled_positions_{}".format(k)],
+                "test_folds": arrays["test_folds_{}".format(k)]
+            }
+    return store
+
+
+def split_positions(store: dict, k: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    # (train, test) row positions into the base frame, one pair per test fold drawn for k
+    if k not in store["splits"]:
+        raise KeyError("no splits for k = {} in the store, it has k in {}".format(k, sorted(store["splits"])))
+    splits = store["splits"][k]
+    return k_fold_split_idxs_from_draw(splits["shuffled_positions"], k, splits["test_folds"])
+
+
+def split_frames(store: dict, base_df: pd.DataFrame, k: int) -> list[tuple[pd.DataFrame, pd.DataFrame]]:
+    if not base_df.index.equals(pd.Index(store["index"])):
+        raise ValueError("the base frame doesn't have the rows the store was built over")
+    return [(base_df.take(train_idxs), base_df.take(test_idxs)) for train_idxs, test_idxs in split_positions(store, k)]
+
+
+def load_csv_split(k: int, data_dir: str = "data", store_path: str = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # The frames pd.read_csv("{k}-train_df.csv", index_col=0) and pd.read_csv("{k}-test_df.csv", index_col=0)
+    # give, without the CSVs
+    if store_path is None:
+        store_path = os.path.join(data_dir, SPLIT_STORE_FILENAME)
+    [(train_df, test_df)] = split_frames(load_split_store(store_path), base_frame(data_dir), k)
+    return train_df, test_df
+
+
+def write_legacy_split_store(data_dir: str = "data") -> str:
+    path = os.path.join(data_dir, SPLIT_STORE_FILENAME)
+    save_split_store(legacy_split_store(base_frame(data_dir).index), path)
+    return path